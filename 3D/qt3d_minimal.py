@@ -1,7 +1,7 @@
 import sys
 import time
 import os.path
-import struct
+import array
 import multiprocessing
 
 try:
@@ -130,7 +130,7 @@ class View3D(QWidget):
         # Position Attribute
         position_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
         # position_data_buffer.setData(QByteArray(np.array(geometry.verts).astype(np.float32).tobytes()))
-        position_data_buffer.setData(struct.pack('%sf' % len(geometry.verts), *geometry.verts))
+        position_data_buffer.setData(array.array('f', geometry.verts).tobytes())
         position_attribute = QAttribute()
         position_attribute.setAttributeType(QAttribute.VertexAttribute)
         position_attribute.setBuffer(position_data_buffer)
@@ -146,7 +146,7 @@ class View3D(QWidget):
         if len(geometry.normals) > 0:
             normals_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
             # normals_data_buffer.setData(QByteArray(np.array(geometry.normals).astype(np.float32).tobytes()))
-            normals_data_buffer.setData(struct.pack('%sf' % len(geometry.normals), *geometry.normals))
+            normals_data_buffer.setData(array.array('f', geometry.normals).tobytes())
             normal_attribute = QAttribute()
             normal_attribute.setAttributeType(QAttribute.VertexAttribute)
             normal_attribute.setBuffer(normals_data_buffer)
@@ -183,7 +183,7 @@ class View3D(QWidget):
         # Color Attribute
         color_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
         # color_data_buffer.setData(QByteArray(np.array(color_list).astype(np.float32).tobytes()))
-        color_data_buffer.setData(struct.pack('%sf' % len(color_list), *color_list))
+        color_data_buffer.setData(array.array('f', color_list).tobytes())
         color_attribute = QAttribute()
         color_attribute.setAttributeType(QAttribute.VertexAttribute)
         color_attribute.setBuffer(color_data_buffer)
@@ -198,7 +198,7 @@ class View3D(QWidget):
         # Faces Index Attribute
         index_data_buffer = QBuffer(QBuffer.IndexBuffer, custom_geometry)
         # index_data_buffer.setData(QByteArray(np.array(geometry.faces).astype(np.uintc).tobytes()))
-        index_data_buffer.setData(struct.pack("{}I".format(len(geometry.faces)), *geometry.faces))
+        index_data_buffer.setData(array.array('I', geometry.faces).tobytes())
         index_attribute = QAttribute()
         index_attribute.setVertexBaseType(QAttribute.UnsignedInt)
         index_attribute.setAttributeType(QAttribute.IndexAttribute)
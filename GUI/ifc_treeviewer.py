@@ -10,6 +10,19 @@ except Exception:
     from PySide2.QtWidgets import *
 import ifcopenshell
 
+# which decomposition relationships each IFC class has
+class_relationships = {}
+
+
+def get_relationships(ifc_object):
+    # the same for all objects of a class, so only checked once per class
+    ifc_class = ifc_object.is_a(True)
+    relationships = class_relationships.get(ifc_class)
+    if relationships is None:
+        relationships = (hasattr(ifc_object, 'ContainsElements'), hasattr(ifc_object, 'IsDecomposedBy'))
+        class_relationships[ifc_class] = relationships
+    return relationships
+
 
 class ViewTree(QWidget):
     def __init__(self):
@@ -19,6 +32,7 @@ class ViewTree(QWidget):
         self.setLayout(vbox)
         # Object Tree
         self.object_tree = QTreeWidget()
+        self.object_tree.setUniformRowHeights(True)  # only text, so all rows are equally high
         vbox.addWidget(self.object_tree)
         self.object_tree.setColumnCount(3)
         self.object_tree.setHeaderLabels(["Name", "Class", "ID"])
@@ -30,21 +44,38 @@ class ViewTree(QWidget):
             [self.ifc_file.wrapped_data.header.file_name.name, 'File', ""])
         for item in self.ifc_file.by_type('IfcProject'):
             self.add_object_in_tree(item, root_item)
-        # Finish the GUI
+        # Finish the GUI, the branch was built before it was added to the tree
+        self.object_tree.setUpdatesEnabled(False)
         self.object_tree.addTopLevelItem(root_item)
         self.object_tree.expandToDepth(3)
+        self.object_tree.setUpdatesEnabled(True)
+
+    @staticmethod
+    def create_object_item(ifc_object, parent_item=None):
+        strings = [ifc_object.Name, ifc_object.is_a(), ifc_object.GlobalId]
+        if parent_item is not None:
+            # attached in the constructor, no separate addChild needed
+            return QTreeWidgetItem(parent_item, strings)
+        return QTreeWidgetItem(strings)
 
     def add_object_in_tree(self, ifc_object, parent_item):
-        tree_item = QTreeWidgetItem([ifc_object.Name, ifc_object.is_a(), ifc_object.GlobalId])
-        parent_item.addChild(tree_item)
-        if hasattr(ifc_object, 'ContainsElements'):
-            for rel in ifc_object.ContainsElements:
-                for element in rel.RelatedElements:
-                    self.add_object_in_tree(element, tree_item)
-        if hasattr(ifc_object, 'IsDecomposedBy'):
-            for rel in ifc_object.IsDecomposedBy:
-                for related_object in rel.RelatedObjects:
-                    self.add_object_in_tree(related_object, tree_item)
+        tree_item = self.create_object_item(ifc_object, parent_item)
+        # a stack of (object, tree item) pairs instead of recursion, so deep trees are no problem
+        stack = [(ifc_object, tree_item)]
+        while stack:
+            ifc_object, tree_item = stack.pop()
+            children = []
+            has_contains_elements, has_is_decomposed_by = get_relationships(ifc_object)
+            if has_contains_elements:
+                for rel in ifc_object.ContainsElements:
+                    children.extend(rel.RelatedElements)
+            if has_is_decomposed_by:
+                for rel in ifc_object.IsDecomposedBy:
+                    children.extend(rel.RelatedObjects)
+            # all children of an item are added at once
+            child_items = [self.create_object_item(child) for child in children]
+            tree_item.addChildren(child_items)
+            stack.extend(zip(children, child_items))
 
 
 if __name__ == '__main__':
@@ -11,6 +11,59 @@ except Exception:
     from PySide2.QtWidgets import *
 import ifcopenshell
 
+# (name, type) of all attributes, for each IFC class
+attribute_metadata = {}
+# the value attribute to display, for each class of quantity
+quantity_value_names = {
+    'IfcQuantityLength': 'LengthValue',
+    'IfcQuantityArea': 'AreaValue',
+    'IfcQuantityVolume': 'VolumeValue',
+    'IfcQuantityCount': 'CountValue',
+    'IfcQuantityWeight': 'WeightValue',
+    'IfcQuantityTime': 'TimeValue',
+}
+
+
+def get_attribute_metadata(ifc_object):
+    # the names and types only depend on the class, so look them up once per class
+    ifc_class = ifc_object.is_a(True)
+    metadata = attribute_metadata.get(ifc_class)
+    if metadata is None:
+        metadata = [(ifc_object.attribute_name(i), ifc_object.attribute_type(i)) for i in range(len(ifc_object))]
+        attribute_metadata[ifc_class] = metadata
+    return metadata
+
+
+def index_children(ifc_file):
+    # one pass over each kind of relationship, by STEP id of the parent,
+    # instead of the ContainsElements and IsDecomposedBy of every object
+    children_index = {}
+    for rel in ifc_file.by_type('IfcRelContainedInSpatialStructure'):  # ContainsElements
+        children_index.setdefault(rel.RelatingStructure.id(), []).extend(rel.RelatedElements)
+    # IsDecomposedBy also contains the nesting relationships in IFC2X3
+    decomposition = 'IfcRelDecomposes' if ifc_file.schema == 'IFC2X3' else 'IfcRelAggregates'
+    for rel in ifc_file.by_type(decomposition):  # IsDecomposedBy
+        children_index.setdefault(rel.RelatingObject.id(), []).extend(rel.RelatedObjects)
+    return children_index
+
+
+def index_definitions(ifc_file):
+    # the types and the property/quantity sets from IsDefinedBy, by STEP id of the object,
+    # sorted out once here instead of checking each relationship on every selection
+    types_index = {}
+    property_sets_index = {}
+    # IsDefinedBy also contains the type relationships in IFC2X3
+    if ifc_file.schema == 'IFC2X3':
+        for rel in ifc_file.by_type('IfcRelDefinesByType'):
+            for ifc_object in rel.RelatedObjects:
+                types_index.setdefault(ifc_object.id(), []).append(rel.RelatingType)
+    for rel in ifc_file.by_type('IfcRelDefinesByProperties'):
+        property_set = rel.RelatingPropertyDefinition
+        if property_set.is_a('IfcPropertySet') or property_set.is_a('IfcElementQuantity'):
+            for ifc_object in rel.RelatedObjects:
+                property_sets_index.setdefault(ifc_object.id(), []).append(property_set)
+    return types_index, property_sets_index
+
 
 class ViewTree(QWidget):
     def __init__(self):
@@ -20,121 +73,148 @@ class ViewTree(QWidget):
         self.setLayout(vbox)
         # Object Tree
         self.object_tree = QTreeWidget()
+        self.object_tree.setUniformRowHeights(True)  # only text, so all rows are equally high
         vbox.addWidget(self.object_tree)
         self.object_tree.setColumnCount(3)
         self.object_tree.setHeaderLabels(["Name", "Class", "ID"])
         self.object_tree.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.object_tree.selectionModel().selectionChanged.connect(self.add_data)
+        # the property tree is rebuilt once the selection is complete, not for every change
+        self.selection_timer = QTimer(self)
+        self.selection_timer.setSingleShot(True)
+        self.selection_timer.setInterval(0)
+        self.selection_timer.timeout.connect(self.add_data)
+        self.object_tree.selectionModel().selectionChanged.connect(lambda: self.selection_timer.start())
         # Property Tree
         self.property_tree = QTreeWidget()
+        self.property_tree.setUniformRowHeights(True)
         vbox.addWidget(self.property_tree)
         self.property_tree.setColumnCount(3)
         self.property_tree.setHeaderLabels(["Name", "Value", "ID/Type"])
+        # filled property and quantity set items, by their STEP id, to be cloned
+        self.property_set_items = {}
+        # the relationships of the current file, by STEP id (see load_file)
+        self.children_index = {}
+        self.types_index = {}
+        self.property_sets_index = {}
 
     def load_file(self, filename):
         # Import the IFC File
         self.ifc_file = ifcopenshell.open(filename)
+        self.property_set_items = {}  # the STEP ids refer to the previous file
+        self.children_index = index_children(self.ifc_file)
+        self.types_index, self.property_sets_index = index_definitions(self.ifc_file)
         root_item = QTreeWidgetItem(
             [self.ifc_file.wrapped_data.header.file_name.name, 'File', ""])
         for item in self.ifc_file.by_type('IfcProject'):
             self.add_object_in_tree(item, root_item)
-        # Finish the GUI
+        # Finish the GUI, the branch was built before it was added to the tree
+        self.object_tree.setUpdatesEnabled(False)
         self.object_tree.addTopLevelItem(root_item)
         self.object_tree.expandToDepth(3)
+        self.object_tree.setUpdatesEnabled(True)
 
     # Attributes
     def add_attributes_in_tree(self, ifc_object, parent_item):
         # the individual attributes
-        for att_idx in range(0, len(ifc_object)):
-            # https://github.com/jakob-beetz/IfcOpenShellScriptingTutorial/wiki/02:-Inspecting-IFC-instance-objects
-            att_name = ifc_object.attribute_name(att_idx)
-            att_value = str(ifc_object[att_idx])
-            att_type = ifc_object.attribute_type(att_name)
-            attribute_item = QTreeWidgetItem([att_name, att_value, att_type])
-            parent_item.addChild(attribute_item)
+        # https://github.com/jakob-beetz/IfcOpenShellScriptingTutorial/wiki/02:-Inspecting-IFC-instance-objects
+        info = ifc_object.get_info(include_identifier=False, recursive=False)  # all values in one call
+        attribute_items = []
+        for att_name, att_type in get_attribute_metadata(ifc_object):
+            att_value = str(info[att_name])
+            attribute_items.append(QTreeWidgetItem([att_name, att_value, att_type]))
+        parent_item.addChildren(attribute_items)
 
     # PropertySet
     def add_properties_in_tree(self, property_set, parent_item):
         # the individual properties
+        property_items = []
         for prop in property_set.HasProperties:
-            unit = str(prop.Unit) if hasattr(prop, 'Unit') else ''
+            info = prop.get_info(include_identifier=False, recursive=False)  # all values in one call
+            unit = str(info['Unit']) if 'Unit' in info else ''
             prop_value = '<not handled>'
-            if prop.is_a('IfcPropertySingleValue'):
-                prop_value = str(prop.NominalValue.wrappedValue)
-            parent_item.addChild(QTreeWidgetItem([prop.Name, prop_value, unit]))
+            if info['type'] == 'IfcPropertySingleValue':
+                prop_value = str(info['NominalValue'].wrappedValue)
+            property_items.append(QTreeWidgetItem([info['Name'], prop_value, unit]))
+        parent_item.addChildren(property_items)
 
     # QuantitySet
     def add_quantities_in_tree(self, quantity_set, parent_item):
         # the individual quantities
+        quantity_items = []
         for quantity in quantity_set.Quantities:
-            unit = str(quantity.Unit) if hasattr(quantity, 'Unit') else ''
+            info = quantity.get_info(include_identifier=False, recursive=False)  # all values in one call
+            unit = str(info['Unit']) if 'Unit' in info else ''
             quantity_value = '<not handled>'
-            if quantity.is_a('IfcQuantityLength'):
-                quantity_value = str(quantity.LengthValue)
-            elif quantity.is_a('IfcQuantityArea'):
-                quantity_value = str(quantity.AreaValue)
-            elif quantity.is_a('IfcQuantityVolume'):
-                quantity_value = str(quantity.VolumeValue)
-            elif quantity.is_a('IfcQuantityCount'):
-                quantity_value = str(quantity.CountValue)
-            parent_item.addChild(QTreeWidgetItem([quantity.Name, quantity_value, unit]))
+            value_name = quantity_value_names.get(info['type'])
+            if value_name is not None:
+                quantity_value = str(info[value_name])
+            quantity_items.append(QTreeWidgetItem([info['Name'], quantity_value, unit]))
+        parent_item.addChildren(quantity_items)
+
+    def create_property_set_item(self, property_set):
+        # a set shared by many objects is only read once, afterwards we hand out copies
+        template = self.property_set_items.get(property_set.id())
+        if template is None:
+            template = QTreeWidgetItem([property_set.Name, property_set.is_a(), property_set.GlobalId])
+            if property_set.is_a('IfcPropertySet'):
+                self.add_properties_in_tree(property_set, template)
+            else:
+                self.add_quantities_in_tree(property_set, template)
+            self.property_set_items[property_set.id()] = template
+        return template.clone()  # also copies the children
 
     def add_data(self):
-        self.property_tree.clear()
         items = self.object_tree.selectedItems()
-        for item in items:
-            # the GUID is in the third column
-            buffer = item.text(2)
-            if not buffer:
-                break
-            # find the related object in our IFC file
-            ifc_object = self.ifc_file.by_guid(buffer)
-            if ifc_object is None:
-                break
-
-            # Attributes
-            attributes_item = QTreeWidgetItem(["Attributes", "", ifc_object.GlobalId])
-            self.property_tree.addTopLevelItem(attributes_item)
-            self.add_attributes_in_tree(ifc_object, attributes_item)
-
-            # Properties & Quantities
-            if hasattr(ifc_object, 'IsDefinedBy'):
-                for definition in ifc_object.IsDefinedBy:
-                    if definition.is_a('IfcRelDefinesByType'):
-                        type_object = definition.RelatingType
-                        type_item = QTreeWidgetItem([type_object.Name,
-                                                     type_object.is_a(),
-                                                     type_object.GlobalId])
-                        self.property_tree.addTopLevelItem(type_item)
-                    if definition.is_a('IfcRelDefinesByProperties'):
-                        property_set = definition.RelatingPropertyDefinition
-                        # the individual properties/quantities
-                        if property_set.is_a('IfcPropertySet'):
-                            properties_item = QTreeWidgetItem([property_set.Name,
-                                                               property_set.is_a(),
-                                                               property_set.GlobalId])
-                            self.property_tree.addTopLevelItem(properties_item)
-                            self.add_properties_in_tree(property_set, properties_item)
-                        elif property_set.is_a('IfcElementQuantity'):
-                            quantities_item = QTreeWidgetItem([property_set.Name,
-                                                               property_set.is_a(),
-                                                               property_set.GlobalId])
-                            self.property_tree.addTopLevelItem(quantities_item)
-                            self.add_quantities_in_tree(property_set, quantities_item)
-
-            self.property_tree.expandAll()
+        # no repaint for every added item, only once the tree is complete
+        self.property_tree.setUpdatesEnabled(False)
+        try:
+            self.property_tree.clear()
+            for item in items:
+                # the object is kept in the item, so it is not looked up by GUID again
+                ifc_object = item.data(0, Qt.UserRole)
+                if ifc_object is None:
+                    continue  # e.g. the file item
+
+                # Attributes
+                attributes_item = QTreeWidgetItem(self.property_tree,
+                                                  ["Attributes", "", ifc_object.GlobalId])
+                self.add_attributes_in_tree(ifc_object, attributes_item)
+
+                # Properties & Quantities
+                for type_object in self.types_index.get(ifc_object.id(), ()):
+                    QTreeWidgetItem(self.property_tree, [type_object.Name,
+                                                         type_object.is_a(),
+                                                         type_object.GlobalId])
+                # the individual properties/quantities
+                for property_set in self.property_sets_index.get(ifc_object.id(), ()):
+                    self.property_tree.addTopLevelItem(self.create_property_set_item(property_set))
+
+            self.property_tree.expandToDepth(1)  # the sets and their direct content
+        finally:
+            self.property_tree.setUpdatesEnabled(True)
+
+    @staticmethod
+    def create_object_item(ifc_object, parent_item=None):
+        strings = [ifc_object.Name, ifc_object.is_a(), ifc_object.GlobalId]
+        if parent_item is not None:
+            # attached in the constructor, no separate addChild needed
+            tree_item = QTreeWidgetItem(parent_item, strings)
+        else:
+            tree_item = QTreeWidgetItem(strings)
+        tree_item.setData(0, Qt.UserRole, ifc_object)
+        return tree_item
 
     def add_object_in_tree(self, ifc_object, parent_item):
-        tree_item = QTreeWidgetItem([ifc_object.Name, ifc_object.is_a(), ifc_object.GlobalId])
-        parent_item.addChild(tree_item)
-        if hasattr(ifc_object, 'ContainsElements'):
-            for rel in ifc_object.ContainsElements:
-                for element in rel.RelatedElements:
-                    self.add_object_in_tree(element, tree_item)
-        if hasattr(ifc_object, 'IsDecomposedBy'):
-            for rel in ifc_object.IsDecomposedBy:
-                for related_object in rel.RelatedObjects:
-                    self.add_object_in_tree(related_object, tree_item)
+        tree_item = self.create_object_item(ifc_object, parent_item)
+        # a stack of (object, tree item) pairs instead of recursion, so deep trees are no problem
+        stack = [(ifc_object, tree_item)]
+        while stack:
+            ifc_object, tree_item = stack.pop()
+            children = self.children_index.get(ifc_object.id(), [])
+            # all children of an item are added at once
+            child_items = [self.create_object_item(child) for child in children]
+            tree_item.addChildren(child_items)
+            stack.extend(zip(children, child_items))
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
-# import sys
+import sys
 # import os.path
 import re
+import functools
+import operator
 
 try:
     from PyQt5.QtCore import *
@@ -13,6 +15,19 @@ except Exception:
 
 import ifcopenshell
 
+# The value attribute of each class of quantity
+QUANTITY_GETTERS = {
+    'IfcQuantityLength': operator.attrgetter('LengthValue'),
+    'IfcQuantityArea': operator.attrgetter('AreaValue'),
+    'IfcQuantityVolume': operator.attrgetter('VolumeValue'),
+    'IfcQuantityCount': operator.attrgetter('CountValue'),
+    'IfcQuantityWeight': operator.attrgetter('WeightValue'),
+    'IfcQuantityTime': operator.attrgetter('TimeValue'),
+}
+
+# Attribute types which can be edited with the delegate (also used by the property tree)
+EDITABLE_TYPES = frozenset({'STRING', 'DOUBLE', 'ENUMERATION', 'INT', 'BOOL'})
+
 
 # region Utility Methods
 
@@ -24,64 +39,228 @@ def entity_summary(entity):
 
     :param entity: The IFC entity instance
     """
-    myId = str(entity.id()) if hasattr(entity, "id") else "<no id>"
-    myName = entity.Name if hasattr(entity, "Name") else "<no name>"
-    myClass = entity.is_a() if hasattr(entity, "is_a") else "<no class>"
-    myGlobalId = entity.GlobalId if hasattr(entity, "GlobalId") else "<no GlobalId>"
+    if not isinstance(entity, ifcopenshell.entity_instance):
+        return "<no entity>"
+    att_names = get_attribute_names_from_object(entity)
+    myId = str(entity.id())
+    myName = entity.Name if "Name" in att_names else "<no name>"
+    myClass = entity.is_a()
+    myGlobalId = entity.GlobalId if "GlobalId" in att_names else "<no GlobalId>"
     return str("STEP id\t: #{}\nName\t: {}\nClass\t: {}\nGlobalId\t: {}").format(
         myId, myName, myClass, myGlobalId)
 
 
+@functools.lru_cache(maxsize=None)
+def get_schema(schema_name):
+    """
+    Return the schema definition from the IfcOpenShell wrapper (cached).
+
+    :param schema_name: name of the schema, e.g., 'IFC2X3' or 'IFC4'
+    """
+    return ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_declaration(schema_name, ifc_class):
+    """
+    Return the declaration of an IFC class from the schema (cached).
+
+    :param schema_name: name of the schema, e.g., 'IFC2X3' or 'IFC4'
+    :param ifc_class: name of the IFC class
+    """
+    return get_schema(schema_name).declaration_by_name(ifc_class)
+
+
+@functools.lru_cache(maxsize=None)
+def get_enum_items(schema_name, ifc_class, att_index):
+    """
+    Return the enumeration items for one attribute of a class (cached).
+    Enumerations never change within a schema, so these can be reused.
+
+    :param schema_name: name of the schema, e.g., 'IFC2X3' or 'IFC4'
+    :param ifc_class: name of the IFC class
+    :param att_index: index of the attribute in the class
+    """
+    attribute = get_declaration(schema_name, ifc_class).attribute_by_index(att_index)
+    return tuple(attribute.type_of_attribute().declared_type().enumeration_items())
+
+
+@functools.lru_cache(maxsize=None)
+def get_enum_description(schema_name, ifc_class, att_index):
+    """
+    Return the enumeration items for one attribute of a class as a single
+    string, e.g. to be used in a tooltip (cached).
+
+    :param schema_name: name of the schema, e.g., 'IFC2X3' or 'IFC4'
+    :param ifc_class: name of the IFC class
+    :param att_index: index of the attribute in the class
+    """
+    return ' - '.join(get_enum_items(schema_name, ifc_class, att_index))
+
+
+@functools.lru_cache(maxsize=None)
+def get_attribute_names(schema_name, ifc_class):
+    """
+    Return the names of all attributes of an IFC class, including the
+    inherited and the inverse attributes (cached).
+
+    :param schema_name: name of the schema, e.g., 'IFC2X3' or 'IFC4'
+    :param ifc_class: name of the IFC class
+    """
+    declaration = get_declaration(schema_name, ifc_class)
+    names = [a.name() for a in declaration.all_attributes()]
+    names += [a.name() for a in declaration.all_inverse_attributes()]
+    return frozenset(names)
+
+
+@functools.lru_cache(maxsize=None)
+def get_attribute_indices(schema_name, ifc_class):
+    """
+    Return a dictionary from the name of each (direct) attribute
+    of an IFC class to its index (cached).
+
+    :param schema_name: name of the schema, e.g., 'IFC2X3' or 'IFC4'
+    :param ifc_class: name of the IFC class
+    """
+    declaration = get_declaration(schema_name, ifc_class)
+    return {a.name(): index for index, a in enumerate(declaration.all_attributes())}
+
+
+def get_attribute_names_from_object(ifc_object):
+    """
+    Return the names of all (inverse) attributes of the class of an IFC object.
+    Use this when checking several attributes of the same object.
+
+    :param ifc_object: instance of an IFC object
+    :type ifc_object: entity_instance
+    """
+    schema_name, ifc_class = ifc_object.is_a(True).split('.')
+    return get_attribute_names(schema_name, ifc_class)
+
+
+def has_attribute(ifc_object, att_name):
+    """
+    Check whether an IFC object has a particular attribute, based on its class.
+    This is a cheaper alternative to hasattr() on entity instances.
+
+    :param ifc_object: instance of an IFC object
+    :type ifc_object: entity_instance
+    :param att_name: name of the attribute
+    :type att_name: str
+    """
+    return att_name in get_attribute_names_from_object(ifc_object)
+
+
+def get_global_id(entity):
+    """
+    Return the GlobalId of an IFC object, or '' when it has none.
+    Also accepts other data, such as the file stored in a tree item.
+    The check is based on the class, see has_attribute.
+
+    :param entity: instance of an IFC object
+    :type entity: entity_instance
+    """
+    if isinstance(entity, ifcopenshell.entity_instance) and has_attribute(entity, 'GlobalId'):
+        return entity.GlobalId or ''
+    return ''
+
+
+# Attribute types per IFC class (including the schema), see get_attribute_types
+_attribute_types = {}
+
+
+def get_attribute_types(ifc_object):
+    """
+    Return the types of all attributes of an IFC object, e.g. 'STRING' or 'ENTITY INSTANCE'.
+    The types only depend on the class, so they are only queried once per class.
+
+    :param ifc_object: instance of an IFC object
+    :type ifc_object: entity_instance
+    :return: tuple of type names, in attribute order
+    """
+    ifc_class = ifc_object.is_a(True)
+    types = _attribute_types.get(ifc_class)
+    if types is None:
+        types = tuple(sys.intern(ifc_object.attribute_type(i)) for i in range(len(ifc_object)))
+        _attribute_types[ifc_class] = types
+    return types
+
+
+# (name, type) of all attributes per IFC class (including the schema), see get_attribute_metadata
+_attribute_metadata = {}
+
+
+def get_attribute_metadata(ifc_object):
+    """
+    Return the names and types of all attributes of an IFC object.
+    These only depend on the class, so they are only queried once per class.
+
+    :param ifc_object: instance of an IFC object
+    :type ifc_object: entity_instance
+    :return: tuple of (name, type) pairs, in attribute order
+    """
+    ifc_class = ifc_object.is_a(True)
+    metadata = _attribute_metadata.get(ifc_class)
+    if metadata is None:
+        names = (sys.intern(name) for name in ifc_object.wrapped_data.get_attribute_names())
+        metadata = tuple(zip(names, get_attribute_types(ifc_object)))
+        _attribute_metadata[ifc_class] = metadata
+    return metadata
+
+
 def get_enums_from_object(ifc_object, att_name):
     """
     Check the schema to get the list of enumerations
     for one particular attribute of a class.
 
-    As we don't know the schema from the object (or do we?)
-    we try both the IFC2x3 and IFC4 schemes.
+    The schema is taken from the object itself (e.g., 'IFC2X3.IfcWall'),
+    so this works for both IFC2x3 and IFC4 models.
 
     :param ifc_object: instance of an IFC object
     :type ifc_object: entity_instance
     :param att_name: name of the attribute
     :type att_name: str
     """
-    if hasattr(ifc_object, att_name):
+    if has_attribute(ifc_object, att_name):
         att_index = ifc_object.wrapped_data.get_argument_index(att_name)
         # att_value = ifc_object.wrapped_data.get_argument(att_index)
         # att_type = ifc_object.wrapped_data.get_argument_type(att_index)
         att_type = ifc_object.attribute_type(att_index)
         if att_type == 'ENUMERATION':
             try:
-                schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name('IFC2x3')
-                e_class = schema.declaration_by_name(ifc_object.is_a())
-                attribute = e_class.attribute_by_index(att_index)
-                return attribute.type_of_attribute().declared_type().enumeration_items()
-            except:
-                pass
-            try:
-                schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name('IFC4')
-                e_class = schema.declaration_by_name(ifc_object.is_a())
-                attribute = e_class.attribute_by_index(att_index)
-                return attribute.type_of_attribute().declared_type().enumeration_items()
+                schema_name, ifc_class = ifc_object.is_a(True).split('.')
+                return get_enum_items(schema_name, ifc_class, att_index)
             except:
                 pass
 
 
+# Splits CamelCase into words, e.g. 'IfcRelAggregates' into 'Ifc', 'Rel', 'Aggregates'
+_CAMEL_CASE_RE = re.compile(r'[A-Z](?:[a-z]+|[A-Z]*(?=[A-Z]|$))')
+
+
 def camel_case_split(string):
-    return re.findall(r'[A-Z](?:[a-z]+|[A-Z]*(?=[A-Z]|$))', string)
+    return _CAMEL_CASE_RE.findall(string)
 
 
-def get_friendly_ifc_name(ifc_object):
+@functools.lru_cache(maxsize=1024)
+def get_friendly_class_name(ifc_class):
+    """
+    Return a readable name for an IFC class, e.g. 'Rel Aggregates' for 'IfcRelAggregates' (cached).
+
+    :param ifc_class: name of the IFC class
+    """
     # Trick to split the IfcClass into separate words
-    s = ' '.join(camel_case_split(str(ifc_object.is_a())))
-    s = s[4:]
-    return s
+    return ' '.join(camel_case_split(ifc_class))[4:]
+
+
+def get_friendly_ifc_name(ifc_object):
+    # The friendly name only depends on the class, so it is cached per class
+    return get_friendly_class_name(ifc_object.is_a())
 
 # endregion
 
 # region Delegates & Editing
 
-
 def str2bool(v):
     return str(v).lower() in ("yes", "y", "true", "t", ".t.", "1")
 
@@ -92,9 +271,15 @@ class QCustomDelegate(QItemDelegate):
 
     send_update_object = pyqtSignal(object)
 
+    # Background colors for editable cells and for properties, created only once
+    EDITABLE_COLOR = QColor(191, 222, 185, 30)
+    PROPERTY_COLOR = QColor(191, 185, 222, 30)
+
     def __init__(self, parent):
         QItemDelegate.__init__(self, parent)
         self.allowed_column = -1
+        # Background color per IFC class of the target, filled in while painting
+        self.class_colors = {}
 
     def set_allowed_column(self, col):
         self.allowed_column = col
@@ -108,7 +293,6 @@ class QCustomDelegate(QItemDelegate):
         But do nothing for other data types
         """
         # model = index.model()
-        # row = index.row()
         column = index.column()
         # parent = index.parent()
         if column == self.allowed_column or self.allowed_column == -1:
@@ -223,7 +407,7 @@ class QCustomDelegate(QItemDelegate):
                 else:
                     # regular attributes > based on attribute index
                     print("Attribute", att_index, "current:", att_value, "new:", att_new_value)
-                    if att_value != att_new_value and hasattr(target, att_name):
+                    if att_value != att_new_value and has_attribute(target, att_name):
                         try:
                             if att_type == 'ENTITY INSTANCE':
                                 print('Can not set instance from string')
@@ -258,32 +442,46 @@ class QCustomDelegate(QItemDelegate):
     def updateEditorGeometry(self, editor, option, index):
         editor.setGeometry(option.rect)
 
+    def get_class_colors(self, target):
+        """
+        Return the background colors for editable cells and for properties
+        which apply to the class of the target (None if not applicable).
+        These only depend on the class, so they are only checked once per class.
+
+        :param target: the IFC entity instance shown in the cell
+        """
+        ifc_class = target.is_a()
+        colors = self.class_colors.get(ifc_class)
+        if colors is None:
+            colors = (None if target.is_a('IfcPhysicalQuantity') else self.EDITABLE_COLOR,
+                      self.PROPERTY_COLOR if target.is_a('IfcPropertySingleValue') else None)
+            self.class_colors[ifc_class] = colors
+        return colors
+
     def paint(self, painter, styleoptions, index):
         """
         Add a greenish background color to indicate editable cells
         """
         # model = index.model()
-        row = index.row()
         column = index.column()
         # parent = index.parent()
         if column == self.allowed_column or self.allowed_column == -1:
-            ifc_object = index.data(Qt.UserRole)
-            att_name = index.data(Qt.UserRole + 1)
+            # ifc_object = index.data(Qt.UserRole)
+            # att_name = index.data(Qt.UserRole + 1)
             # att_value = index.data(Qt.UserRole + 2)
             att_type = index.data(Qt.UserRole + 3)
             # att_index = index.data(Qt.UserRole + 4)
-            ifc_sub_object = index.data(Qt.UserRole + 5)
-            target = ifc_object
-            if ifc_sub_object is not None:
-                target = ifc_sub_object
+            target = index.data(Qt.UserRole + 5)  # sub_object
+            if target is None:
+                target = index.data(Qt.UserRole)  # ifc_object
             if target is not None:
-                if att_name != 'GlobalId'\
-                        and att_type in ['STRING', 'DOUBLE', 'ENUMERATION', 'INT', 'BOOL']\
-                        and not target.is_a('IfcPhysicalQuantity'):
+                editable_color, property_color = self.get_class_colors(target)
+                if editable_color is not None and att_type in EDITABLE_TYPES\
+                        and index.data(Qt.UserRole + 1) != 'GlobalId':
                     # add a greenish background color to indicate editable cells
-                    painter.fillRect(styleoptions.rect, QColor(191, 222, 185, 30))
-                elif target.is_a('IfcPropertySingleValue'):
-                    painter.fillRect(styleoptions.rect, QColor(191, 185, 222, 30))
+                    painter.fillRect(styleoptions.rect, editable_color)
+                elif property_color is not None:
+                    painter.fillRect(styleoptions.rect, property_color)
 
         # But also do the regular paint
         QItemDelegate.paint(self, painter, styleoptions, index)
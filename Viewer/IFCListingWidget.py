@@ -1,6 +1,7 @@
 import sys
 import os.path
 import csv
+import logging
 
 try:
     from PyQt5.QtCore import *
@@ -14,13 +15,16 @@ except Exception:
 import ifcopenshell
 from IFCCustomDelegate import *
 
+# selection messages are only shown when debug logging is enabled
+logger = logging.getLogger(__name__)
+
 # region Utility Functions
 
 
 def get_type_name(element):
     """Retrieve name of the relating Type"""
     result = {}
-    if hasattr(element, 'IsDefinedBy') is False:
+    if not has_attribute(element, 'IsDefinedBy'):
         return result
 
     for definition in element.IsDefinedBy:
@@ -54,19 +58,20 @@ def get_attribute_by_name(element, attribute_name):
     elif attribute_name == "type":
         return get_type_name(element)
 
-    for att_idx in range(0, len(element)):
-        att_name = element.attribute_name(att_idx)
-        if att_name == attribute_name:
-            try:
-                att = element[att_idx]
-                # att = element.wrapped_data.get_argument(att_name)
-                result['att_value'] = str(element.wrap_value(att))
-                result['att_type'] = element.attribute_type(att_idx)
-                result['att_idx'] = att_idx
-                result['IsEditable'] = True
-                return result
-            except:
-                return result
+    # the index of the attribute only depends on the class
+    schema_name, ifc_class = element.is_a(True).split('.')
+    att_idx = get_attribute_indices(schema_name, ifc_class).get(attribute_name)
+    if att_idx is not None:
+        try:
+            att = element[att_idx]
+            # att = element.wrapped_data.get_argument(att_name)
+            result['att_value'] = str(element.wrap_value(att))
+            result['att_type'] = get_attribute_types(element)[att_idx]
+            result['att_idx'] = att_idx
+            result['IsEditable'] = True
+            return result
+        except:
+            return result
 
 
 def get_property_or_quantity_by_name(element, prop_or_quantity_name):
@@ -75,13 +80,13 @@ def get_property_or_quantity_by_name(element, prop_or_quantity_name):
     # result['object'] = element
     # result['att_name'] = prop_or_quantity_name
     result['IsEditable'] = False
-    if hasattr(element, 'IsDefinedBy') is False:
+    if not has_attribute(element, 'IsDefinedBy'):
         return result
 
     # result['ifc_sub_object'] = element
     for definition in element.IsDefinedBy:
         if definition.is_a('IfcRelDefinesByProperties'):
-            if hasattr(definition.RelatingPropertyDefinition, "HasProperties"):
+            if has_attribute(definition.RelatingPropertyDefinition, "HasProperties"):
                 for prop in definition.RelatingPropertyDefinition.HasProperties:
                     if prop.Name == prop_or_quantity_name and prop.is_a('IfcPropertySingleValue'):
                         result['ifc_sub_object'] = prop
@@ -90,27 +95,17 @@ def get_property_or_quantity_by_name(element, prop_or_quantity_name):
                         result['att_idx'] = 2  # NominalValue
                         result['IsEditable'] = True
                         return result  # str(prop.NominalValue.wrappedValue), prop
-            if hasattr(definition.RelatingPropertyDefinition, "Quantities"):
+            if has_attribute(definition.RelatingPropertyDefinition, "Quantities"):
                 for quantity in definition.RelatingPropertyDefinition.Quantities:
                     if quantity.Name == prop_or_quantity_name:
                         result['ifc_sub_object'] = quantity
                         result['att_type'] = quantity.attribute_type(3)
                         result['att_idx'] = 3  # Quantity Value
                         result['IsEditable'] = False
-                        if quantity.is_a('IfcQuantityLength'):
-                            result['att_value'] = quantity.LengthValue
-                            return result
-                        elif quantity.is_a('IfcQuantityArea'):
-                            result['att_value'] = quantity.AreaValue
-                            return result
-                        elif quantity.is_a('IfcQuantityVolume'):
-                            result['att_value'] = quantity.VolumeValue
-                            return result
-                        elif quantity.is_a('IfcQuantityCount'):
-                            result['att_value'] = quantity.CountValue
-                            return result
-                        else:
-                            return result
+                        getter = QUANTITY_GETTERS.get(quantity.is_a())
+                        if getter is not None:
+                            result['att_value'] = getter(quantity)
+                        return result
 
 
 def takeoff_element(element, header):
@@ -299,15 +294,17 @@ class IFCListingWidget(QWidget):
 
     #region Files & UI methods
 
-    def load_file(self, filename):
+    def load_file(self, filename, ifc_file=None):
         """
         Load the IFC file passed as filename.
 
         :param filename: Full path to the IFC file
         :type filename: str
+        :param ifc_file: the IFC model, when it was opened already (e.g., shared with other views)
         """
-        ifc_file = None
-        if filename in self.ifc_files:
+        if ifc_file is not None:
+            self.ifc_files[filename] = ifc_file
+        elif filename in self.ifc_files:
             ifc_file = self.ifc_files[filename]
         else:  # Load as new file
             ifc_file = ifcopenshell.open(filename)
@@ -454,9 +451,9 @@ class IFCListingWidget(QWidget):
 
     # region Selection Methods
 
-    select_object = pyqtSignal(object)
-    deselect_object = pyqtSignal(object)
-    send_selection_set = pyqtSignal(object)
+    select_object = pyqtSignal(str)
+    deselect_object = pyqtSignal(str)
+    send_selection_set = pyqtSignal(list)
 
     def send_selection(self, selected_items, deselected_items):
         # selection_model = self.object_table.selectionModel()
@@ -465,44 +462,36 @@ class IFCListingWidget(QWidget):
         # for item in items:
         for index in selected_items.indexes():
             if index.column() == 0:  # only for first column, to avoid repeats
-                entity = index.data(Qt.UserRole)
-                if hasattr(entity, "GlobalId"):
-                    GlobalId = entity.GlobalId
-                    if GlobalId != '':
-                        self.select_object.emit(GlobalId)
-                        print("IFCListingWidget.send_selection.select_object ", GlobalId)
+                GlobalId = get_global_id(index.data(Qt.UserRole))
+                if GlobalId != '':
+                    self.select_object.emit(GlobalId)
+                    logger.debug("IFCListingWidget.send_selection.select_object %s", GlobalId)
 
         # send the deselected items as well
         for index in deselected_items.indexes():
             if index.column() == 0:  # only for first column, to avoid repeats
-                entity = index.data(Qt.UserRole)
-                if hasattr(entity, "GlobalId"):
-                    GlobalId = entity.GlobalId
-                    if GlobalId != '':
-                        self.deselect_object.emit(GlobalId)
-                        print("IFCListingWidget.send_selection.deselect_object ", GlobalId)
+                GlobalId = get_global_id(index.data(Qt.UserRole))
+                if GlobalId != '':
+                    self.deselect_object.emit(GlobalId)
+                    logger.debug("IFCListingWidget.send_selection.deselect_object %s", GlobalId)
 
     def receive_selection(self, ids):
-        print("IFCListingWidget.receive_selection ", ids)
+        logger.debug("IFCListingWidget.receive_selection %s", ids)
         selection_model = self.object_table.selectionModel()
         # check if already selected
         index = selection_model.currentIndex()
-        entity = index.data(Qt.UserRole)
-        if entity is not None and hasattr(entity, "GlobalId"):
-            if entity.GlobalId == ids:
-                return
+        if ids and get_global_id(index.data(Qt.UserRole)) == ids:
+            return
         selection_model.clearSelection()
         if not len(ids):
             return
 
         for r in range(self.model.rowCount()):
             index = self.model.index(r, 0)  # only for first column, to avoid repeats
-            entity = index.data(Qt.UserRole)
-            if entity is not None and hasattr(entity, "GlobalId"):
-                if entity.GlobalId == ids:
-                    self.object_table.selectRow(r)
-                    # selection_model.select(index, QItemSelectionModel.Rows)
-                    self.object_table.scrollTo(index)
+            if get_global_id(index.data(Qt.UserRole)) == ids:
+                self.object_table.selectRow(r)
+                # selection_model.select(index, QItemSelectionModel.Rows)
+                self.object_table.scrollTo(index)
 
     # endregion
 
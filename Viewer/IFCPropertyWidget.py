@@ -1,6 +1,7 @@
 import sys
 import os.path
-# import re
+import collections
+import re
 
 try:
     from PyQt5.QtCore import *
@@ -14,6 +15,106 @@ except Exception:
 import ifcopenshell
 from IFCCustomDelegate import *
 
+# Attribute types which refer to other entities
+_ENTITY_TYPES = frozenset({'ENTITY INSTANCE', 'AGGREGATE OF ENTITY INSTANCE'})
+# Large attribute hierarchies which are only followed with the "Full" option
+_SKIPPED_ATTRIBUTES = frozenset({'OwnerHistory', 'Representation', 'ObjectPlacement'})
+# FILE_DESCRIPTION entries are formatted as key[description]
+_DESCRIPTION_RE = re.compile(r'([^\[]*)\[(.*)\]$')
+
+
+def make_row(name, value, tooltip=None):
+    """
+    Return a [name, value] pair of QStandardItems, ready to be appended as a row
+
+    :param name: text for the first column
+    :param value: value for the second column (converted to string once)
+    :param tooltip: optional tooltip for the name item
+    """
+    name_item = QStandardItem(name)
+    if tooltip is not None:
+        name_item.setToolTip(tooltip)
+    return [name_item, QStandardItem(str(value))]
+
+
+class IFCPropertyModel(QStandardItemModel):
+    """
+    Item Model for the Property Tree, which only fills in the attributes
+    of nested entities when their row gets expanded in the view.
+    Deferred rows carry the entity and the recursion level in their first column.
+    Filled rows remember the STEP id of their entity, so the ids of all the entities
+    above a row are known and cycles in the IFC graph are not offered for expansion.
+    """
+
+    def __init__(self, fetch_attributes, parent=None):
+        """
+        :param fetch_attributes: method to fill attributes, called as (ifc_object, parent_item, recursion, visited)
+        :param parent: the owner of the model
+        """
+        QStandardItemModel.__init__(self, 0, 3, parent)
+        self.fetch_attributes = fetch_attributes
+
+    def defer_attributes(self, ifc_object, item, recursion=0):
+        """
+        Mark the item to receive the attributes of the IFC entity once it is expanded
+
+        :param ifc_object: IFC entity
+        :param item: QStandardItem which will hold the attributes
+        :param recursion: The recursion level to pass on
+        """
+        item.setData(ifc_object, Qt.UserRole + 6)  # deferred entity
+        item.setData(recursion, Qt.UserRole + 7)  # recursion level
+
+    def set_entity_id(self, ifc_object, item):
+        """
+        Remember the STEP id of the IFC entity whose attributes are shown under the item
+
+        :param ifc_object: IFC entity
+        :param item: QStandardItem holding the attributes
+        """
+        item.setData(ifc_object.id(), Qt.UserRole + 8)  # entity id
+
+    def get_visited_ids(self, item):
+        """
+        Return the STEP ids of the entities shown at the item and above it
+
+        :param item: QStandardItem
+        """
+        visited = set()
+        while item is not None:
+            entity_id = item.data(Qt.UserRole + 8)
+            if entity_id is not None:
+                visited.add(entity_id)
+            item = item.parent()
+        return visited
+
+    def is_deferred(self, index):
+        return index.isValid() and index.column() == 0 and index.data(Qt.UserRole + 6) is not None
+
+    def hasChildren(self, parent=QModelIndex()):
+        if self.is_deferred(parent):
+            return True
+        return QStandardItemModel.hasChildren(self, parent)
+
+    def canFetchMore(self, parent):
+        if self.is_deferred(parent):
+            return True
+        return QStandardItemModel.canFetchMore(self, parent)
+
+    def fetchMore(self, parent):
+        if not self.is_deferred(parent):
+            return QStandardItemModel.fetchMore(self, parent)
+        item = self.itemFromIndex(parent)
+        ifc_object = item.data(Qt.UserRole + 6)
+        recursion = item.data(Qt.UserRole + 7)
+        item.setData(None, Qt.UserRole + 6)  # only fetch once
+        self.set_entity_id(ifc_object, item)
+        try:
+            self.fetch_attributes(ifc_object, item, recursion, self.get_visited_ids(item))
+        except:
+            print('Except nested Entity Instance')
+            pass
+
 
 class IFCPropertyWidget(QWidget):
     """
@@ -27,6 +128,7 @@ class IFCPropertyWidget(QWidget):
     - V5 = QTreeWidget replaced with QTreeView
     - V6 = Inverse Attributes
     - V7 = Updated Delegate (shared with other views/widgets)
+    - V8 = Custom Item Model, filling nested entities only when expanded
     """
 
     send_update_object = pyqtSignal(object)
@@ -37,6 +139,8 @@ class IFCPropertyWidget(QWidget):
         QWidget.__init__(self)
         # The list of the currently loaded objects
         self.loaded_objects_and_files = []
+        # The data of the selected items the tree was last filled from (see set_from_selected_items)
+        self.shown_selection = None
 
         # Main Settings
         self.follow_attributes = False
@@ -46,6 +150,8 @@ class IFCPropertyWidget(QWidget):
         self.follow_assignments = False
         self.follow_defines = False
         self.show_all = False
+        # IsDefinedBy relations per object, split by kind (see get_definitions)
+        self.definitions = {}
 
         # Widgets Setup
         vbox = QVBoxLayout()
@@ -99,6 +205,10 @@ class IFCPropertyWidget(QWidget):
 
         # Property Tree
         self.property_tree = QTreeView()
+        self.property_tree.setUniformRowHeights(True)  # no need to measure each row
+        self.property_tree.setSortingEnabled(False)
+        self.property_tree.setAnimated(False)
+        self.property_tree.setAlternatingRowColors(False)
         delegate = QCustomDelegate(self)
         delegate.set_allowed_column(1)
         delegate.send_update_object.connect(self.send_update_object)  # to warn name changes
@@ -106,8 +216,17 @@ class IFCPropertyWidget(QWidget):
         self.property_tree.setEditTriggers(QAbstractItemView.CurrentChanged)  # open editor upon first click
         # self.property_tree.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Not editable tree
         # self.property_tree.setItemDelegateForColumn(1, delegate)
-        self.model = None
-        self.reset()
+        # The model is kept for the lifetime of the widget, reset() only removes its rows
+        self.model = IFCPropertyModel(self.add_attributes_in_tree, self)
+        self.model.setHeaderData(0, Qt.Horizontal, "Name")
+        self.model.setHeaderData(1, Qt.Horizontal, "Value")
+        self.model.setHeaderData(2, Qt.Horizontal, "ID/Type")
+        self.property_tree.setModel(self.model)
+        self.property_tree.setColumnWidth(0, 200)
+        self.property_tree.setColumnWidth(1, 200)
+        self.property_tree.setColumnWidth(2, 50)
+        # fixed widths, so the header never measures the contents
+        self.property_tree.header().setSectionResizeMode(QHeaderView.Interactive)
         vbox.addWidget(self.property_tree)
 
     # endregion
@@ -121,35 +240,59 @@ class IFCPropertyWidget(QWidget):
 
         :param items: List of QTreeWidgetItems (containing data in column 1)
         """
-        self.reset()
-        for item in items:
-            # our very first item is the File, so show the Header only
-            if item.text(1) == "File":
-                model = item.data(0, Qt.UserRole)
-                if model is None:
-                    break
-                self.add_file_header(model)
-            else:
-                ifc_object = item.data(0, Qt.UserRole)
-                if ifc_object is None:
-                    break
-                self.add_object_data(ifc_object)
+        selection = [item.data(0, Qt.UserRole) for item in items]
+        if selection == self.shown_selection:
+            return  # e.g. the same selection coming back from another view
+        self.definitions.clear()
+        self.begin_update()
+        try:
+            self.reset()
+            shown_files = set()  # the header of a file is shown only once
+            for item in items:
+                # our very first item is the File, so show the Header only
+                if item.text(1) == "File":
+                    model = item.data(0, Qt.UserRole)
+                    if model is None:
+                        continue
+                    if id(model) in shown_files:
+                        continue
+                    shown_files.add(id(model))
+                    self.add_file_header(model)
+                else:
+                    ifc_object = item.data(0, Qt.UserRole)
+                    if ifc_object is None:
+                        continue
+                    self.add_object_data(ifc_object)
+        finally:
+            self.end_update()
+        self.shown_selection = selection
+
+    def receive_object_update(self, ifc_object):
+        """
+        Refill the tree when an object which is shown was changed elsewhere
+
+        :param ifc_object: the changed IFC entity
+        """
+        if ifc_object in self.loaded_objects_and_files:
+            self.regenerate()
 
     # endregion
 
     # region InformationFilling
 
-    def add_inverse_attributes_in_tree(self, ifc_object, parent_item, recursion=0):
+    def add_inverse_attributes_in_tree(self, ifc_object, parent_item, recursion=0, visited=None):
         """
-        Fill the property tree with the inverse ttributes of an object. When the "show all"
-        option is activated, this will enable recursive attribute display. This can
-        potentially go very deep and take a long time with deep structures or
-        large geometry.
+        Fill the property tree with the inverse attributes of an object.
+        The attributes of the referring entities are only filled in
+        when their row is expanded (see IFCPropertyModel).
 
         :param ifc_object: IFC entity
         :param parent_item: QStandardItem used to put attributes underneath
         :param recursion: To avoid infinite recursion, the recursion level is checked
+        :param visited: STEP ids of the entities shown above, which are not offered again
         """
+        if visited is None:
+            visited = {ifc_object.id()}
         attributes = ifc_object.wrapped_data.get_inverse_attribute_names()
         for att_idx, att_name in enumerate(attributes):
             att_value = ""  # str(ifc_object[att_idx])
@@ -166,7 +309,7 @@ class IFCPropertyWidget(QWidget):
             if len(inv_attribute_tuple) > 0:
                 for i, nested_att in enumerate(inv_attribute_tuple):
                     att_class = get_friendly_ifc_name(nested_att) if nested_att is not None else ''
-                    nested_attribute_item0 = QStandardItem("[" + str(i) + "]")
+                    nested_attribute_item0 = QStandardItem(f"[{i}]")
                     nested_attribute_item1 = QStandardItem(att_class)
                     # nested_attribute_item1.setToolTip(att_value)
                     # nested_attribute_item2 = QStandardItem(att_type)
@@ -176,28 +319,38 @@ class IFCPropertyWidget(QWidget):
                     # nested_attribute_item0.setData(att_class, Qt.UserRole + 3)  # type
                     # nested_attribute_item0.setData(i, Qt.UserRole + 4)  # index
                     attribute_item0.appendRow([nested_attribute_item0, nested_attribute_item1])
-                    self.add_attributes_in_tree(nested_att, nested_attribute_item0)
+                    if nested_att is not None and nested_att.id() not in visited:
+                        self.model.defer_attributes(nested_att, nested_attribute_item0, recursion + 1)
 
-    def add_attributes_in_tree(self, ifc_object, parent_item, recursion=0):
+    def add_attributes_in_tree(self, ifc_object, parent_item, recursion=0, visited=None):
         """
         Fill the property tree with the attributes of an object. When the "show all"
-        option is activated, this will enable recursive attribute display. This can
-        potentially go very deep and take a long time with deep structures or
-        large geometry.
+        option is activated, this will enable recursive attribute display.
+        Nested entities are not visited here: their rows are deferred and
+        filled in when expanded (see IFCPropertyModel), which keeps this
+        method free of recursion, however deep the structure.
 
         :param ifc_object: IFC entity
         :param parent_item: QStandardItem used to put attributes underneath
         :param recursion: To avoid infinite recursion, the recursion level is checked
+        :param visited: STEP ids of the entities shown above, which are not offered again
         """
-        for att_idx in range(0, len(ifc_object)):
-            # https://github.com/jakob-beetz/IfcOpenShellScriptingTutorial/wiki/02:-Inspecting-IFC-instance-objects
-            att_name = ifc_object.attribute_name(att_idx)
-            att_value = str(ifc_object[att_idx])
-            att_type = ifc_object.attribute_type(att_idx)
-            if not self.show_all and (att_type == ('ENTITY INSTANCE' or 'AGGREGATE OF ENTITY INSTANCE')):
+        if visited is None:
+            visited = {ifc_object.id()}
+        # https://github.com/jakob-beetz/IfcOpenShellScriptingTutorial/wiki/02:-Inspecting-IFC-instance-objects
+        # get_info collects all attribute values in a single call
+        info = ifc_object.get_info(include_identifier=False, recursive=False)
+        is_single_value = ifc_object.is_a('IfcPropertySingleValue')
+        # names and types are cached per class
+        for att_idx, (att_name, att_type) in enumerate(get_attribute_metadata(ifc_object)):
+            attribute = info[att_name]  # fetch once, reused for display and recursion
+            # don't serialize entity references when their value is not displayed anyway
+            if not self.show_all and att_type in _ENTITY_TYPES:
                 att_value = ''
+            else:
+                att_value = str(attribute)
             # but for properties, we can show a value
-            if not self.show_all and ifc_object.is_a('IfcPropertySingleValue') and att_name == 'NominalValue':
+            if not self.show_all and is_single_value and att_name == 'NominalValue':
                 att_value = str(ifc_object.NominalValue.wrappedValue)
             attribute_item0 = QStandardItem(att_name)
             attribute_item1 = QStandardItem(att_value)
@@ -211,29 +364,28 @@ class IFCPropertyWidget(QWidget):
                 attribute_item1.setData(ifc_object.NominalValue, Qt.UserRole + 5)  # sub_object
                 attribute_item1.setEditable(True)
             attribute_item2 = QStandardItem(att_type)
-            if att_type in ['STRING', 'DOUBLE', 'INT', 'ENUMERATION']:
+            if att_type in EDITABLE_TYPES:
                 attribute_item1.setEditable(True)
             if att_type == 'ENUMERATION':
-                enums = get_enums_from_object(ifc_object, att_name)
-                attribute_item1.setStatusTip(' - '.join(enums))
-                attribute_item1.setToolTip(' - '.join(enums))
+                schema_name, ifc_class = ifc_object.is_a(True).split('.')
+                enums = get_enum_description(schema_name, ifc_class, att_idx)
+                attribute_item1.setStatusTip(enums)
+                attribute_item1.setToolTip(enums)
 
             parent_item.appendRow([attribute_item0, attribute_item1, attribute_item2])
 
             # Skip?
-            if not self.show_all:
-                if att_name == 'OwnerHistory' or 'Representation' or 'ObjectPlacement':
-                    continue
+            if not self.show_all and att_name in _SKIPPED_ATTRIBUTES:
+                continue
 
             # Recursive call to display the attributes of ENTITY INSTANCES and AGGREGATES
-            attribute = ifc_object[att_idx]
             if attribute is not None and recursion < 20:
-                if att_type == 'ENTITY INSTANCE':
-                    self.add_attributes_in_tree(attribute, attribute_item0, recursion + 1)
+                if att_type == 'ENTITY INSTANCE' and attribute.id() not in visited:
+                    self.model.defer_attributes(attribute, attribute_item0, recursion + 1)
                 if att_type == 'AGGREGATE OF DOUBLE':
-                    attribute_item0.setText(attribute_item0.text() + ' [' + str(len(attribute)) + ']')
+                    attribute_item0.setText(f'{attribute_item0.text()} [{len(attribute)}]')
                     for counter, value in enumerate(attribute):
-                        nested_item0 = QStandardItem("[" + str(counter) + "]")
+                        nested_item0 = QStandardItem(f"[{counter}]")
                         nested_item1 = QStandardItem(str(value))
                         nested_item2 = QStandardItem("DOUBLE")
                         # nested_item1.setData(nested_entity, Qt.UserRole)  # remember the owner of this attribute
@@ -243,23 +395,19 @@ class IFCPropertyWidget(QWidget):
                         # nested_item1.setData(att_idx, Qt.UserRole + 4)  # index
                         attribute_item0.appendRow([nested_item0, nested_item1, nested_item2])
                 if att_type == 'AGGREGATE OF ENTITY INSTANCE':
-                    attribute_item0.setText(attribute_item0.text() + ' [' + str(len(attribute)) + ']')
+                    attribute_item0.setText(f'{attribute_item0.text()} [{len(attribute)}]')
                     for counter, nested_entity in enumerate(attribute):
-                        nested_item0 = QStandardItem("[" + str(counter) + "]")
+                        nested_item0 = QStandardItem(f"[{counter}]")
                         nested_item1 = QStandardItem(get_friendly_ifc_name(nested_entity))
-                        nested_item2 = QStandardItem("#" + str(nested_entity.id()))
+                        nested_item2 = QStandardItem(f"#{nested_entity.id()}")
                         nested_item1.setData(nested_entity, Qt.UserRole)  # remember the owner of this attribute
                         # nested_item1.setData(att_name, Qt.UserRole + 1)  # name
                         # nested_item1.setData(att_value, Qt.UserRole + 2)  # value
                         # nested_item1.setData(att_type, Qt.UserRole + 3)  # type
                         # nested_item1.setData(att_idx, Qt.UserRole + 4)  # index
                         attribute_item0.appendRow([nested_item0, nested_item1, nested_item2])
-                        try:
-                            self.add_attributes_in_tree(nested_entity, nested_item0,
-                                                        recursion + 1)  # forced high depth
-                        except:
-                            print('Except nested Entity Instance')
-                            pass
+                        if nested_entity.id() not in visited:
+                            self.model.defer_attributes(nested_entity, nested_item0, recursion + 1)
 
     def add_properties_in_tree(self, property_set, parent_item):
         """
@@ -270,33 +418,38 @@ class IFCPropertyWidget(QWidget):
         """
         for index, prop in enumerate(property_set.HasProperties):
             if self.show_all:
-                prop_item0 = QStandardItem("[" + str(index) + "]")
+                prop_item0 = QStandardItem(f"[{index}]")
                 parent_item.appendRow([prop_item0])
-                self.add_attributes_in_tree(prop, prop_item0)
+                self.model.defer_attributes(prop, prop_item0)
             else:
-                unit = str(prop.Unit) if hasattr(prop, 'Unit') else ''
+                # get_info reads the class, name, value and unit in a single call
+                info = prop.get_info(include_identifier=False, recursive=False)
+                prop_name = info['Name']
+                unit = str(info['Unit']) if 'Unit' in info else ''
                 prop_value = '<not handled>'
-                if prop.is_a('IfcPropertySingleValue'):
-                    prop_value = str(prop.NominalValue.wrappedValue)
-                    prop_item0 = QStandardItem(prop.Name)
+                prop_class = info['type']
+                if prop_class == 'IfcPropertySingleValue':
+                    prop_value = str(info['NominalValue'].wrappedValue)
+                    prop_item0 = QStandardItem(prop_name)
                     prop_item1 = QStandardItem(prop_value)
                     prop_item2 = QStandardItem(unit)
                     prop_item1.setData(prop, Qt.UserRole)  # object
-                    prop_item1.setData(prop.Name, Qt.UserRole + 1)  # name
+                    prop_item1.setData(prop_name, Qt.UserRole + 1)  # name
                     prop_item1.setData(prop_value, Qt.UserRole + 2)  # value
                     prop_item1.setData(unit, Qt.UserRole + 3)  # type
                     prop_item1.setData(index, Qt.UserRole + 4)  # index
                     prop_item1.setData(prop, Qt.UserRole + 5)  # sub_object
                     parent_item.appendRow([prop_item0, prop_item1, prop_item2])
-                elif prop.is_a('IfcComplexProperty'):
-                    property_item0 = QStandardItem(prop.Name)
+                elif prop_class == 'IfcComplexProperty':
+                    property_item0 = QStandardItem(prop_name)
                     # property_item1 = QStandardItem('')
                     property_item2 = QStandardItem(unit)
                     parent_item.appendRow([property_item0, None, property_item2])
-                    for nested_index, nested_prop in enumerate(prop.HasProperties):
-                        nested_name = nested_prop.Name
-                        nested_value = str(nested_prop.NominalValue.wrappedValue)
-                        nested_unit = str(nested_prop.Unit) if hasattr(nested_prop, 'Unit') else ''
+                    for nested_index, nested_prop in enumerate(info['HasProperties']):
+                        nested_info = nested_prop.get_info(include_identifier=False, recursive=False)
+                        nested_name = nested_info['Name']
+                        nested_value = str(nested_info['NominalValue'].wrappedValue)
+                        nested_unit = str(nested_info['Unit']) if 'Unit' in nested_info else ''
                         prop_nested_item0 = QStandardItem(nested_name)
                         prop_nested_item1 = QStandardItem(nested_value)
                         prop_nested_item2 = QStandardItem(nested_unit)
@@ -308,11 +461,11 @@ class IFCPropertyWidget(QWidget):
                         prop_nested_item1.setData(nested_prop, Qt.UserRole + 5)  # sub_object
                         property_item0.appendRow([prop_nested_item0, prop_nested_item1, prop_nested_item2])
                 else:
-                    property_item0 = QStandardItem(prop.Name)
+                    property_item0 = QStandardItem(prop_name)
                     property_item1 = QStandardItem(prop_value)
                     property_item2 = QStandardItem(unit)
                     property_item1.setData(prop, Qt.UserRole)
-                    property_item1.setData(prop.Name, Qt.UserRole + 1)  # name
+                    property_item1.setData(prop_name, Qt.UserRole + 1)  # name
                     property_item1.setData(prop_value, Qt.UserRole + 2)  # value
                     property_item1.setData(unit, Qt.UserRole + 3)  # type
                     property_item1.setData(index, Qt.UserRole + 4)  # index
@@ -330,16 +483,9 @@ class IFCPropertyWidget(QWidget):
             if self.show_all:
                 self.add_attributes_in_tree(quantity, parent_item)
             else:
-                unit = str(quantity.Unit) if hasattr(quantity, 'Unit') else ''
-                quantity_value = '<not handled>'
-                if quantity.is_a('IfcQuantityLength'):
-                    quantity_value = str(quantity.LengthValue)
-                elif quantity.is_a('IfcQuantityArea'):
-                    quantity_value = str(quantity.AreaValue)
-                elif quantity.is_a('IfcQuantityVolume'):
-                    quantity_value = str(quantity.VolumeValue)
-                elif quantity.is_a('IfcQuantityCount'):
-                    quantity_value = str(quantity.CountValue)
+                unit = str(quantity.Unit) if has_attribute(quantity, 'Unit') else ''
+                getter = QUANTITY_GETTERS.get(quantity.is_a())
+                quantity_value = str(getter(quantity)) if getter else '<not handled>'
 
                 prop_item0 = QStandardItem(quantity.Name)
                 prop_item1 = QStandardItem(quantity_value)
@@ -354,44 +500,62 @@ class IFCPropertyWidget(QWidget):
         self.loaded_objects_and_files.append(ifc_file)
         header_item = QStandardItem("Header")
         header_item.setData(ifc_file, Qt.UserRole)
-        self.model.invisibleRootItem().appendRow([header_item])
 
         header = ifc_file.wrapped_data.header
         FILE_DESCRIPTION_item = QStandardItem("FILE_DESCRIPTION")
         header_item.appendRow([FILE_DESCRIPTION_item])
-        for desc in header.file_description.description:
+        file_description = header.file_description
+        rows = []
+        for desc in file_description.description:
             # desc = ...[...:...]"
-            key = desc.split("[")[0]
-            description = desc[len(key) + 1:-1]
-            tree_item1 = QStandardItem(key)
-            tree_item2 = QStandardItem(description)
-            tree_item1.setToolTip(description)
-            FILE_DESCRIPTION_item.appendRow([tree_item1, tree_item2])
-        FILE_DESCRIPTION_item.appendRow(
-            [QStandardItem("implementation_level"),
-             QStandardItem(str(header.file_description.implementation_level))])
+            match = _DESCRIPTION_RE.match(desc)
+            key, description = match.groups() if match else (desc, '')
+            rows.append(make_row(key, description, description))
+        rows.append(make_row("implementation_level", file_description.implementation_level))
+        for row in rows:
+            FILE_DESCRIPTION_item.appendRow(row)
 
         FILE_NAME_item = QStandardItem("FILE_NAME")
         header_item.appendRow([FILE_NAME_item])
-        FILE_NAME_item.appendRow([QStandardItem("name"), QStandardItem(str(header.file_name.name))])
-        FILE_NAME_item.appendRow([QStandardItem("time_stamp"), QStandardItem(str(header.file_name.time_stamp))])
-        for author in header.file_name.author:
-            FILE_NAME_item.appendRow([QStandardItem("author"), QStandardItem(str(author))])
-        for organization in header.file_name.organization:
-            FILE_NAME_item.appendRow([QStandardItem("organization"), QStandardItem(str(organization))])
-        FILE_NAME_item.appendRow(
-            [QStandardItem("preprocessor_version"), QStandardItem(str(header.file_name.preprocessor_version))])
-        FILE_NAME_item.appendRow(
-            [QStandardItem("originating_system"), QStandardItem(str(header.file_name.originating_system))])
-        FILE_NAME_item.appendRow([QStandardItem("authorization"), QStandardItem(str(header.file_name.authorization))])
+        file_name = header.file_name
+        rows = [make_row("name", file_name.name),
+                make_row("time_stamp", file_name.time_stamp)]
+        rows.extend(make_row("author", author) for author in file_name.author)
+        rows.extend(make_row("organization", organization) for organization in file_name.organization)
+        rows.append(make_row("preprocessor_version", file_name.preprocessor_version))
+        rows.append(make_row("originating_system", file_name.originating_system))
+        rows.append(make_row("authorization", file_name.authorization))
+        for row in rows:
+            FILE_NAME_item.appendRow(row)
 
         FILE_SCHEMA_item = QStandardItem("FILE_SCHEMA")
         header_item.appendRow([FILE_SCHEMA_item])
         for schema_identifiers in header.file_schema.schema_identifiers:
-            FILE_SCHEMA_item.appendRow(
-                [QStandardItem("schema_identifiers"), QStandardItem(str(schema_identifiers))])
+            FILE_SCHEMA_item.appendRow(make_row("schema_identifiers", schema_identifiers))
+
+        # only add the header to the model once it is complete
+        self.model.invisibleRootItem().appendRow([header_item])
 
-        self.property_tree.expandAll()
+    def get_definitions(self, ifc_object):
+        """
+        Split the IsDefinedBy relations of an object into type and property
+        definitions in a single pass. The result is kept until a new selection
+        is made, so regenerating the tree does not query the relations again.
+
+        :param ifc_object: The IFC Entity instance
+        :return: dictionary from relation class to list of relations
+        """
+        cached = self.definitions.get(id(ifc_object))
+        if cached is not None and cached[0] is ifc_object:
+            return cached[1]
+        definitions = collections.defaultdict(list)
+        for definition in ifc_object.IsDefinedBy:
+            if definition.is_a('IfcRelDefinesByType'):
+                definitions['IfcRelDefinesByType'].append(definition)
+            elif definition.is_a('IfcRelDefinesByProperties'):
+                definitions['IfcRelDefinesByProperties'].append(definition)
+        self.definitions[id(ifc_object)] = (ifc_object, definitions)
+        return definitions
 
     def add_object_data(self, ifc_object):
         """
@@ -400,31 +564,35 @@ class IFCPropertyWidget(QWidget):
         :param ifc_object: The IFC Entity instance to show
         """
         self.loaded_objects_and_files.append(ifc_object)
+        # top level rows are filled while detached and only added to the model at the end
+        rows = []
+        # which relations this class has, queried once for the whole object
+        att_names = get_attribute_names_from_object(ifc_object)
 
         # Attributes
         if self.follow_attributes:
-            attributes_item0 = QStandardItem("Attributes [" + str(len(ifc_object)) + "]")
+            attributes_item0 = QStandardItem(f"Attributes [{len(ifc_object)}]")
             attributes_item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([attributes_item0, attributes_item1])
+            rows.append([attributes_item0, attributes_item1])
+            self.model.set_entity_id(ifc_object, attributes_item0)
             self.add_attributes_in_tree(ifc_object, attributes_item0)
 
         if self.follow_inverse_attributes:
             inv_attributes_item0 =\
-                QStandardItem("Inverse Attributes ["
-                              + str(len(ifc_object.wrapped_data.get_inverse_attribute_names())) + "]")
+                QStandardItem(f"Inverse Attributes [{len(ifc_object.wrapped_data.get_inverse_attribute_names())}]")
             inv_attributes_item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([inv_attributes_item0, inv_attributes_item1])
+            rows.append([inv_attributes_item0, inv_attributes_item1])
+            self.model.set_entity_id(ifc_object, inv_attributes_item0)
             self.add_inverse_attributes_in_tree(ifc_object, inv_attributes_item0)
 
         # Has Assignments
-        if self.follow_assignments and hasattr(ifc_object, 'HasAssignments'):
-            buffer = "HasAssignments [" + str(len(ifc_object.HasAssignments)) + "]"
+        if self.follow_assignments and 'HasAssignments' in att_names:
+            buffer = f"HasAssignments [{len(ifc_object.HasAssignments)}]"
             assignments_item0 = QStandardItem(buffer)
             assignments_item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([assignments_item0, assignments_item1])
-            counter = 0
-            for assignment in ifc_object.HasAssignments:
-                ass_name = assignment.Name if assignment.Name is not None else '[' + str(counter) + ']'
+            rows.append([assignments_item0, assignments_item1])
+            for counter, assignment in enumerate(ifc_object.HasAssignments):
+                ass_name = assignment.Name if assignment.Name is not None else f'[{counter}]'
                 ass_item0 = QStandardItem(ass_name)
                 ass_item0.setData(assignment, Qt.UserRole)
                 # att_name  = index.data(Qt.UserRole + 1)
@@ -435,23 +603,20 @@ class IFCPropertyWidget(QWidget):
                 ass_item1 = QStandardItem(get_friendly_ifc_name(assignment))
                 ass_item2 = QStandardItem(assignment.GlobalId)
                 assignments_item0.appendRow([ass_item0, ass_item1, ass_item2])
-                self.add_attributes_in_tree(assignment, ass_item0)
-                counter += 1
+                self.model.defer_attributes(assignment, ass_item0)
 
         # Defined By (for type, properties & quantities)
         # using attributes (show all)
-        if self.show_all and (self.follow_defines or self.follow_properties) and hasattr(ifc_object,
-                                                                                         'IsDefinedBy'):
-            item0 = QStandardItem("IsDefinedBy [" + str(len(ifc_object.IsDefinedBy)) + "]")
+        if self.show_all and (self.follow_defines or self.follow_properties) and 'IsDefinedBy' in att_names:
+            item0 = QStandardItem(f"IsDefinedBy [{len(ifc_object.IsDefinedBy)}]")
             item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([item0, item1])
-            counter = 0
-            for definition in ifc_object.IsDefinedBy:
+            rows.append([item0, item1])
+            for counter, definition in enumerate(ifc_object.IsDefinedBy):
                 if definition.is_a('IfcRelDefinesByProperties') and not self.follow_properties:
                     continue
                 if definition.is_a('IfcRelDefinesByType') and not self.follow_defines:
                     continue
-                def_name = definition.Name if definition.Name is not None else '[' + str(counter) + ']'
+                def_name = definition.Name if definition.Name is not None else f'[{counter}]'
                 def_item0 = QStandardItem(def_name)
                 def_item0.setData(definition, Qt.UserRole)
                 # att_name  = index.data(Qt.UserRole + 1)
@@ -462,49 +627,50 @@ class IFCPropertyWidget(QWidget):
                 def_item1 = QStandardItem(get_friendly_ifc_name(definition))
                 def_item2 = QStandardItem(definition.GlobalId)
                 item0.appendRow([def_item0, def_item1, def_item2])
-                self.add_attributes_in_tree(definition, def_item0)
-                counter += 1
+                self.model.defer_attributes(definition, def_item0)
         # more streamlined display
-        if not self.show_all and (self.follow_defines or self.follow_properties) and hasattr(ifc_object, 'IsDefinedBy'):
-            buffer = "IsDefinedBy [" + str(len(ifc_object.IsDefinedBy)) + "]"
+        if not self.show_all and (self.follow_defines or self.follow_properties) and 'IsDefinedBy' in att_names:
+            buffer = f"IsDefinedBy [{len(ifc_object.IsDefinedBy)}]"
             defines_item0 = QStandardItem(buffer)
             defines_item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([defines_item0, defines_item1])
-            for definition in ifc_object.IsDefinedBy:
-                if self.follow_defines and definition.is_a('IfcRelDefinesByType'):
-                    type_object = definition.RelatingType
-                    s = get_friendly_ifc_name(type_object)
-                    type_item0 = QStandardItem(type_object.Name)
-                    type_item0.setData(type_item0, Qt.UserRole)
-                    # att_name  = index.data(Qt.UserRole + 1)
-                    # att_value = index.data(Qt.UserRole + 2)
-                    # att_type  = index.data(Qt.UserRole + 3)
-                    # att_index = index.data(Qt.UserRole + 4)
-                    type_item1 = QStandardItem(s)
-                    type_item2 = QStandardItem(type_object.GlobalId)
-                    type_item0.setData(type_object, Qt.UserRole)
-                    defines_item0.appendRow([type_item0, type_item1, type_item2])
-                if self.follow_properties and definition.is_a('IfcRelDefinesByProperties'):
-                    property_set = definition.RelatingPropertyDefinition
-                    prop_item0 = QStandardItem(property_set.Name)
-                    prop_item0.setData(property_set, Qt.UserRole)
-                    # att_name  = index.data(Qt.UserRole + 1)
-                    # att_value = index.data(Qt.UserRole + 2)
-                    # att_type  = index.data(Qt.UserRole + 3)
-                    # att_index = index.data(Qt.UserRole + 4)
-                    prop_item1 = QStandardItem(get_friendly_ifc_name(property_set))
-                    prop_item2 = QStandardItem(property_set.GlobalId)
-                    defines_item0.appendRow([prop_item0, prop_item1, prop_item2])
-                    # the individual properties/quantities
-                    if property_set.is_a('IfcPropertySet'):
-                        self.add_properties_in_tree(property_set, prop_item0)
-                    elif property_set.is_a('IfcElementQuantity'):
-                        self.add_quantities_in_tree(property_set, prop_item0)
-        if self.follow_properties and hasattr(ifc_object, 'HasPropertySets'):
-            buffer = "HasPropertySets [" + str(len(ifc_object.HasPropertySets)) + "]"
+            rows.append([defines_item0, defines_item1])
+            definitions = self.get_definitions(ifc_object)
+            type_definitions = definitions['IfcRelDefinesByType'] if self.follow_defines else []
+            property_definitions = definitions['IfcRelDefinesByProperties'] if self.follow_properties else []
+            for definition in type_definitions:
+                type_object = definition.RelatingType
+                s = get_friendly_ifc_name(type_object)
+                type_item0 = QStandardItem(type_object.Name)
+                type_item0.setData(type_item0, Qt.UserRole)
+                # att_name  = index.data(Qt.UserRole + 1)
+                # att_value = index.data(Qt.UserRole + 2)
+                # att_type  = index.data(Qt.UserRole + 3)
+                # att_index = index.data(Qt.UserRole + 4)
+                type_item1 = QStandardItem(s)
+                type_item2 = QStandardItem(type_object.GlobalId)
+                type_item0.setData(type_object, Qt.UserRole)
+                defines_item0.appendRow([type_item0, type_item1, type_item2])
+            for definition in property_definitions:
+                property_set = definition.RelatingPropertyDefinition
+                prop_item0 = QStandardItem(property_set.Name)
+                prop_item0.setData(property_set, Qt.UserRole)
+                # att_name  = index.data(Qt.UserRole + 1)
+                # att_value = index.data(Qt.UserRole + 2)
+                # att_type  = index.data(Qt.UserRole + 3)
+                # att_index = index.data(Qt.UserRole + 4)
+                prop_item1 = QStandardItem(get_friendly_ifc_name(property_set))
+                prop_item2 = QStandardItem(property_set.GlobalId)
+                defines_item0.appendRow([prop_item0, prop_item1, prop_item2])
+                # the individual properties/quantities
+                if property_set.is_a('IfcPropertySet'):
+                    self.add_properties_in_tree(property_set, prop_item0)
+                elif property_set.is_a('IfcElementQuantity'):
+                    self.add_quantities_in_tree(property_set, prop_item0)
+        if self.follow_properties and 'HasPropertySets' in att_names:
+            buffer = f"HasPropertySets [{len(ifc_object.HasPropertySets)}]"
             defines_item0 = QStandardItem(buffer)
             defines_item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([defines_item0, defines_item1])
+            rows.append([defines_item0, defines_item1])
             for property_set in ifc_object.HasPropertySets:
                 prop_item0 = QStandardItem(property_set.Name)
                 prop_item0.setData(property_set, Qt.UserRole)
@@ -514,10 +680,10 @@ class IFCPropertyWidget(QWidget):
                 self.add_properties_in_tree(property_set, prop_item0)
 
         # Associations (Materials, Classification, ...)
-        if self.follow_associations and hasattr(ifc_object, 'HasAssociations'):
-            item0 = QStandardItem("Associations [" + str(len(ifc_object.HasAssociations)) + "]")
+        if self.follow_associations and 'HasAssociations' in att_names:
+            item0 = QStandardItem(f"Associations [{len(ifc_object.HasAssociations)}]")
             item1 = QStandardItem(get_friendly_ifc_name(ifc_object))
-            self.model.invisibleRootItem().appendRow([item0, item1])
+            rows.append([item0, item1])
             for association in ifc_object.HasAssociations:
                 def_item0 = QStandardItem(association.Name)
                 def_item0.setData(association, Qt.UserRole)
@@ -538,61 +704,78 @@ class IFCPropertyWidget(QWidget):
                                 mat_item0 = QStandardItem(mat.Name)
                                 mat_item0.setData(mat, Qt.UserRole)
                                 mat_item1 = QStandardItem(get_friendly_ifc_name(mat))
-                                mat_item2 = QStandardItem(str('#' + str(mat.id())))
+                                mat_item2 = QStandardItem(f'#{mat.id()}')
                                 def_item0.appendRow([mat_item0, mat_item1, mat_item2])
-                                self.add_attributes_in_tree(mat, mat_item0)
+                                self.model.defer_attributes(mat, mat_item0)
                         elif relating_material.is_a('IfcMaterialLayerSet'):
                             # self.add_attributes_in_tree(relating_material, item)
                             for layer in relating_material.MaterialLayers:
-                                layer_name = layer.Name if hasattr(layer, 'Name') else ''
+                                layer_name = layer.Name if has_attribute(layer, 'Name') else ''
                                 mat_item0 = QStandardItem(layer_name)
                                 mat_item0.setData(layer, Qt.UserRole)
                                 mat_item1 = QStandardItem(get_friendly_ifc_name(layer))
-                                mat_item2 = QStandardItem(str('#' + str(layer.id())))
+                                mat_item2 = QStandardItem(f'#{layer.id()}')
                                 def_item0.appendRow([mat_item0, mat_item1, mat_item2])
-                                self.add_attributes_in_tree(layer, mat_item0)
+                                self.model.defer_attributes(layer, mat_item0)
                         else:
-                            self.add_attributes_in_tree(relating_material, def_item0)
+                            self.model.defer_attributes(relating_material, def_item0)
                     else:  # generic attributes following
-                        self.add_attributes_in_tree(relating_material, def_item0)
+                        self.model.defer_attributes(relating_material, def_item0)
                 elif association.is_a('IfcRelAssociatesClassification'):
                     relating_classification = association.RelatingClassification
-                    self.add_attributes_in_tree(relating_classification, def_item0)
+                    self.model.defer_attributes(relating_classification, def_item0)
 
-        self.property_tree.expandAll()
+        root = self.model.invisibleRootItem()
+        for row in rows:
+            root.appendRow(row)
 
     # endregion
 
     # region Configuring the tree
 
+    def close_files(self):
+        """
+        Clear the tree and drop all references into the loaded models
+        """
+        self.reset()
+        self.definitions.clear()
+
     def reset(self):
-        w0 = 200
-        w1 = 200
-        w2 = 50
-        if self.model is not None:
-            w0 = self.property_tree.columnWidth(0)
-            w1 = self.property_tree.columnWidth(1)
-            w2 = self.property_tree.columnWidth(2)
-            self.model.clear()
-        self.model = QStandardItemModel(0, 3, self)
-        self.property_tree.setModel(self.model)
-        self.property_tree.setColumnWidth(0, w0)
-        self.property_tree.setColumnWidth(1, w1)
-        self.property_tree.setColumnWidth(2, w2)
-        self.model.setHeaderData(0, Qt.Horizontal, "Name")
-        self.model.setHeaderData(1, Qt.Horizontal, "Value")
-        self.model.setHeaderData(2, Qt.Horizontal, "ID/Type")
+        # keep the model (and thus the headers and column widths), only remove the rows
+        self.model.removeRows(0, self.model.rowCount())
         self.loaded_objects_and_files.clear()
+        self.shown_selection = None
+
+    def begin_update(self):
+        """
+        Stop repainting the tree while it is being (re)filled.
+        Always pair with end_update.
+        """
+        self.property_tree.setUpdatesEnabled(False)
+
+    def end_update(self):
+        """
+        Expand the filled tree once and repaint it
+        """
+        self.property_tree.expandToDepth(1)  # deeper levels are filled when expanded
+        self.property_tree.setUpdatesEnabled(True)
+        self.property_tree.viewport().update()  # a single repaint for the whole rebuild
 
     def regenerate(self):
         buffer_list = self.loaded_objects_and_files[:]  # copy items in new list
-        self.reset()
-        for item in buffer_list:
-            # if file
-            if hasattr(item, "id"):
-                self.add_object_data(item)
-            else:
-                self.add_file_header(item)
+        shown_selection = self.shown_selection  # still the same selection
+        self.begin_update()
+        try:
+            self.reset()
+            for item in buffer_list:
+                # if file
+                if hasattr(item, "id"):
+                    self.add_object_data(item)
+                else:
+                    self.add_file_header(item)
+        finally:
+            self.end_update()
+        self.shown_selection = shown_selection
 
     def toggle_attributes(self):
         self.follow_attributes = not self.follow_attributes
@@ -637,9 +820,11 @@ if __name__ == '__main__':
     filename = sys.argv[1]
     if os.path.isfile(filename):
         ifc_file = ifcopenshell.open(filename)
+        w.begin_update()
         w.add_file_header(ifc_file)
         entities = ifc_file.by_type('IfcProject')
         for entity in entities:
             w.add_object_data(entity)
+        w.end_update()
         w.show()
     sys.exit(app.exec_())
@@ -2,9 +2,13 @@
 import sys
 import time
 import os.path
-import struct
+import hashlib
+import itertools
+import logging
 import multiprocessing
 
+import numpy as np
+
 try:
     from PyQt5.QtCore import *
     from PyQt5.QtGui import *
@@ -49,10 +53,338 @@ from OCC.Core.Tesselator import ShapeTesselator
 
 from collections import namedtuple
 shape_tuple = namedtuple("shape_tuple", ("data", "geometry", "styles", "style_ids"))
+# Mesh data ready for the Qt3D buffers (see pack_mesh)
+mesh_tuple = namedtuple("mesh_tuple", ("key", "vertex_data", "triangles", "edges", "alpha"))
+
+# Color for triangles without a material
+DEFAULT_COLOR = (0.8, 0.8, 0.8, 1.0)
+
+# selection messages are only shown when debug logging is enabled
+logger = logging.getLogger(__name__)
+
+
+def wrap_shape(shape):
+    """
+    Return the shape as a shape_tuple, as is already the case for OCC shapes.
+    Shapes with the native triangulation from IfcOpenShell are wrapped,
+    so their element data is available as shape.data as well.
+
+    :param shape: shape from ifcopenshell.geom (iterator or create_shape)
+    """
+    if isinstance(shape, tuple):
+        return shape
+    return shape_tuple(shape, shape.geometry, None, None)
+
+
+def get_placement(shape):
+    """
+    Return the placement of a shape in world coordinates, as a 4x4 numpy matrix.
+    The mesh data of the shape itself is in local coordinates.
+
+    :param shape: shape_tuple (see wrap_shape)
+    """
+    m = shape.data.transformation.matrix.data
+    return np.array([[m[0], m[3], m[6], m[9]],
+                     [m[1], m[4], m[7], m[10]],
+                     [m[2], m[5], m[8], m[11]],
+                     [0.0, 0.0, 0.0, 1.0]])
+
+
+def is_degenerate(meshes, tolerance=1e-4):
+    """
+    Check whether the mesh data of a shape (see IFCQt3dView.tessellate)
+    has no triangles or is too small to be visible at all.
+
+    :param meshes: list of mesh_tuple
+    :param tolerance: smallest extent which is still displayed
+    """
+    vertices = [mesh.vertex_data['position'] for mesh in meshes if len(mesh.triangles) > 0]
+    if not vertices:
+        return True
+    points = np.concatenate(vertices)
+    return (points.max(axis=0) - points.min(axis=0)).max() < tolerance
+
+
+def merge_meshes(meshes):
+    """
+    Merge the parts of a shape with the same transparency into a single mesh,
+    with the colors per vertex, so a shape needs as few renderers as possible.
+
+    :param meshes: list of vertices, normals, triangles, edges and rgba color
+    :return: list of mesh_tuple
+    """
+    groups = {}
+    for mesh in meshes:
+        groups.setdefault(mesh[4][3], []).append(mesh)
+
+    merged = []
+    for alpha, group in groups.items():
+        vertex_counts = [len(mesh[0]) // 3 for mesh in group]
+        offsets = np.cumsum([0] + vertex_counts[:-1])
+        vertices = np.concatenate([mesh[0] for mesh in group])
+        if all(len(mesh[1]) == len(mesh[0]) for mesh in group):
+            normals = np.concatenate([mesh[1] for mesh in group])
+        else:
+            normals = np.empty(0, dtype=np.float32)
+        # the indices of each part continue after the vertices of the previous parts
+        triangles = np.concatenate([mesh[2] + np.uint32(offset) for mesh, offset in zip(group, offsets)])
+        edges = np.concatenate([mesh[3] for mesh in group])
+        colors = np.repeat(np.asarray([mesh[4][:3] for mesh in group], dtype=np.float32), vertex_counts, axis=0)
+        merged.append(pack_mesh(vertices, normals, triangles, edges, colors, float(alpha)))
+    return merged
+
+
+def pack_mesh(vertices, normals, triangles, edges, colors, alpha):
+    """
+    Interleave the positions, normals and colors of a mesh (1 row per vertex),
+    as they are uploaded to the vertex buffer, and compute the key to share it.
+    The colors are stored as 4 bytes (rgba), instead of 3 floats.
+
+    :param vertices: flat float32 array of vertex coordinates
+    :param normals: flat float32 array of normals (can be empty)
+    :param triangles: flat uint32 array of vertex indices
+    :param edges: flat float32 array of the coordinates of the edge vertices
+    :param colors: float32 array with the r, g, b values of each vertex
+    :param alpha: transparency of the whole mesh
+    :return: mesh_tuple
+    """
+    vertex_count = len(vertices) // 3
+    triangles = compact_indices(triangles, vertex_count)
+    has_normals = len(normals) == len(vertices) and len(normals) > 0
+    fields = [('position', np.float32, 3)]
+    if has_normals:
+        fields.append(('normal', np.float32, 3))
+    fields.append(('color', np.uint8, 4))
+    vertex_data = np.empty(vertex_count, dtype=np.dtype(fields))
+    vertex_data['position'] = vertices.reshape(-1, 3)
+    if has_normals:
+        vertex_data['normal'] = normals.reshape(-1, 3)
+    vertex_data['color'][:, :3] = np.rint(colors.reshape(-1, 3) * 255)
+    vertex_data['color'][:, 3] = 255
+    return mesh_tuple(get_mesh_key(vertex_data, triangles), vertex_data, triangles, edges, alpha)
+
+
+def compact_indices(indices, vertex_count):
+    """
+    Return the indices as uint16 when all vertices can be addressed with them,
+    which halves the size of the index buffer, and as uint32 otherwise.
+
+    :param indices: numpy array of vertex indices
+    :param vertex_count: number of vertices the indices refer to
+    """
+    return indices.astype(np.uint16 if vertex_count < 65536 else np.uint32, copy=False)
+
+
+def get_index_type(indices):
+    """
+    Return the QAttribute base type matching the dtype of the indices.
+
+    :param indices: numpy array from compact_indices
+    """
+    return QAttribute.UnsignedShort if indices.dtype == np.uint16 else QAttribute.UnsignedInt
+
+
+def get_mesh_key(*arrays):
+    """
+    Return a digest of the given mesh data, to recognise identical meshes.
+
+    :param arrays: numpy arrays (or other values) describing the mesh
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        # hash the memory of the array directly, without a copy into bytes
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.digest()
+
+
+def create_static_buffer(buffer_type, data, parent):
+    """
+    Create a QBuffer for mesh data which is uploaded once and never changed.
+    The data is not read back from the GPU into the buffer afterwards.
+    The QBuffer keeps its own copy of the data, so the numpy array it came from
+    does not have to be kept alive (there is no QByteArray.fromRawData in PyQt5).
+
+    :param buffer_type: QBuffer.VertexBuffer or QBuffer.IndexBuffer
+    :param data: the raw bytes of the buffer
+    :param parent: the QGeometry owning the buffer
+    :return: QBuffer
+    """
+    data_buffer = QBuffer(buffer_type, parent)
+    data_buffer.setUsage(QBuffer.StaticDraw)
+    data_buffer.setAccessType(QBuffer.Write)
+    data_buffer.setSyncData(False)
+    data_buffer.setData(data)
+    return data_buffer
+
+
+# Shaders for all meshes: vertex colors, with the alpha and highlight as material parameters
+MESH_VERTEX_SHADER = b"""
+#version 150 core
+in vec3 vertexPosition;
+in vec3 vertexNormal;
+in vec3 vertexColor;
+out vec3 color;
+out vec3 normal;
+uniform mat4 modelViewProjection;
+uniform mat3 modelViewNormal;
+void main()
+{
+    color = vertexColor;
+    normal = modelViewNormal * vertexNormal;
+    gl_Position = modelViewProjection * vec4(vertexPosition, 1.0);
+}
+"""
+
+MESH_FRAGMENT_SHADER = b"""
+#version 150 core
+in vec3 color;
+in vec3 normal;
+out vec4 fragColor;
+uniform float alpha;
+uniform bool highlighted;
+uniform vec3 highlightColor;
+void main()
+{
+    // light from the camera, meshes without normals are not shaded
+    float shade = 1.0;
+    if (length(normal) > 0.5)
+        shade = 0.4 + 0.6 * abs(normalize(normal).z);
+    if (highlighted)
+        fragColor = vec4(highlightColor * shade, 1.0);
+    else
+        fragColor = vec4(color * shade, alpha);
+}
+"""
+
+
+def create_mesh_effect(transparent=False, parent=None):
+    """
+    Create the effect which is shared by the materials of all meshes.
+    Each material only sets its own "alpha" and "highlighted" parameters,
+    so selecting an entity does not need to swap its material.
+    Transparent meshes use a second effect, which blends without writing the depth.
+
+    :param transparent: True = enable alpha blending
+    :param parent: QNode owning the effect
+    :return: QEffect
+    """
+    effect = QEffect(parent)
+    effect.setObjectName("Shared Transparent Effect" if transparent else "Shared Mesh Effect")
+    effect.addParameter(QParameter("alpha", 1.0))
+    effect.addParameter(QParameter("highlighted", False))
+    effect.addParameter(QParameter("highlightColor", QColor(50, 250, 50)))
+
+    shader = QShaderProgram()
+    shader.setVertexShaderCode(MESH_VERTEX_SHADER)
+    shader.setFragmentShaderCode(MESH_FRAGMENT_SHADER)
+    render_pass = QRenderPass()
+    render_pass.setShaderProgram(shader)
+    if transparent:
+        blend_arguments = QBlendEquationArguments()
+        blend_arguments.setSourceRgba(QBlendEquationArguments.SourceAlpha)
+        blend_arguments.setDestinationRgba(QBlendEquationArguments.OneMinusSourceAlpha)
+        blend_equation = QBlendEquation()
+        blend_equation.setBlendFunction(QBlendEquation.Add)
+        render_pass.addRenderState(blend_arguments)
+        render_pass.addRenderState(blend_equation)
+        render_pass.addRenderState(QNoDepthMask())
+
+    # used by the forward renderer of the default frame graph
+    filter_key = QFilterKey()
+    filter_key.setName("renderingStyle")
+    filter_key.setValue("forward")
+    technique = QTechnique()
+    technique.graphicsApiFilter().setApi(QGraphicsApiFilter.OpenGL)
+    technique.graphicsApiFilter().setProfile(QGraphicsApiFilter.CoreProfile)
+    technique.graphicsApiFilter().setMajorVersion(3)
+    technique.graphicsApiFilter().setMinorVersion(2)
+    technique.addFilterKey(filter_key)
+    technique.addRenderPass(render_pass)
+    effect.addTechnique(technique)
+    return effect
 
 # endregion
 
 
+class IFCGeometryLoader(QThread):
+    """
+    Background thread which runs the geometry iterator of IfcOpenShell for one file.
+    The shapes are tessellated in this thread, up to the interleaved buffer data,
+    and sent in batches to the 3D View, which only creates the Qt3D entities
+    and buffers in the GUI thread.
+
+    The loader opens its own instance of the file: IfcOpenShell files can not be
+    shared between threads, as entities and inverse attributes are resolved lazily,
+    while the tree, property and take-off views keep reading the model in the GUI thread.
+    The geometry is thus read from disk, without unsaved edits.
+
+    The iterator itself already uses all cores. The shapes it returns can not be
+    pickled, so a process pool would first have to copy all mesh data out of them.
+    Within one file, representations shared by several products are only
+    tessellated once, but nothing is cached on disk between sessions.
+    """
+
+    # Signals carry the loader itself, so outdated loaders can be recognised
+    shapes_ready = pyqtSignal(object, object)
+    loading_done = pyqtSignal(object)
+
+    def __init__(self, filename, settings, tessellate, batch_size=64, batch_interval=0.25, parent=None):
+        """
+        :param filename: Full path to the IFC file
+        :param settings: ifcopenshell.geom.settings for the iterator
+        :param tessellate: method returning the mesh data for a shape
+        :param batch_size: maximum number of shapes sent to the GUI thread at once
+        :param batch_interval: maximum time (in seconds) before a smaller batch is sent
+        :param parent: the owner of the thread
+        """
+        QThread.__init__(self, parent)
+        self.filename = filename
+        self.settings = settings
+        self.tessellate = tessellate
+        self.batch_size = batch_size
+        # from representation id to its mesh data, as products can share their representation
+        self.meshes_by_geometry = {}
+        self.batch_interval = batch_interval
+
+    def run(self):
+        ifc_file = ifcopenshell.open(self.filename)  # only used in this thread
+        # skip openings and spaces geometry (they are still subtracted from their hosts)
+        iterator = ifcopenshell.geom.iterator(self.settings, ifc_file, multiprocessing.cpu_count(),
+                                              exclude=("IfcOpeningElement", "IfcSpace"))
+        batch = []
+        batch_start = time.time()
+        if iterator.initialize():
+            counter = 0
+            while not self.isInterruptionRequested():
+                shape = wrap_shape(iterator.get())
+                try:
+                    # the native geometry has an id, which is shared by all its instances
+                    geometry_id = shape.geometry.id if shape.styles is None else None
+                    meshes = self.meshes_by_geometry.get(geometry_id)
+                    if meshes is None:
+                        meshes = self.tessellate(shape)
+                        if geometry_id is not None:
+                            self.meshes_by_geometry[geometry_id] = meshes
+                    if not is_degenerate(meshes):
+                        batch.append((counter, shape, meshes))
+                except Exception as e:
+                    print(str("Shape {0}\t[#{1}]\tERROR - {2} : {3}")
+                          .format(str(counter), str(shape.data.id), shape.data.product.is_a(), e))
+                # large batches keep the overhead per shape low, but slow shapes
+                # should not keep the GUI thread waiting for a full batch
+                if batch and (len(batch) >= self.batch_size or time.time() - batch_start >= self.batch_interval):
+                    self.shapes_ready.emit(self, batch)
+                    batch = []
+                    batch_start = time.time()
+                counter += 1
+                if not iterator.next():
+                    break
+        if batch:
+            self.shapes_ready.emit(self, batch)
+        self.meshes_by_geometry.clear()
+        self.loading_done.emit(self)
+
+
 class IFCQt3dView(QWidget):
     """
     3D View Widget
@@ -62,11 +394,14 @@ class IFCQt3dView(QWidget):
     - V4 = Object Picking & Selection Syncing (+ reorganise scenegraph)
     - V5 = Working with multiple files (+ reorganise scenegraph again)
     - V6 = Revised Wireframe setup, improved highlights, select also in scenegraph
+    - V7 = Loading geometry in a background thread, keeping the GUI responsive
     """
 
     # Two signals to extend or shrink the selection
     add_to_selected_entities = pyqtSignal(str)
     remove_from_selected_entities = pyqtSignal(str)
+    # Sent with the filename, once all geometry of a file is loaded
+    geometry_loaded = pyqtSignal(str)
 
     # region Initialisation
 
@@ -76,11 +411,26 @@ class IFCQt3dView(QWidget):
         # variables
         self.ifc_files = {}  # from filename to IFC model
         self.model_nodes = {}  # from filename to QEntity node
+        self.loaders = {}  # from filename to the IFCGeometryLoader which is still running
+        self.geometry_cache = {}  # from filename to the renderers shared by identical meshes
+        self.edge_batches = {}  # from filename to the edges of all shapes loaded so far
+        self.mesh_entities = {}  # from filename to the list of all mesh QEntities (for toggling)
+        self.line_entities = {}  # from filename to the QEntity with all edges (for toggling)
+        # from filename to {GlobalId: [(start, end)]}, the edges of each product in the line indices
+        self.edge_ranges = {}
+        # from filename to (all line indices, index attribute), see update_edge_visibility
+        self.line_indices = {}
+        # False = use the triangulation from IfcOpenShell, True = tessellate OCC shapes in Python (slower)
+        self.use_python_opencascade = False
+        self.entities = {}  # from GlobalId to the QEntity of the IFC product
+        self.scene_graph_items = {}  # from QEntity to its item in the scene graph tree
         self.start = time.time()
 
         # 3D View
         self.view = Qt3DWindow()
         self.view.defaultFrameGraph().setClearColor(QColor("#4466ff"))
+        # skip entities outside of the view (no back face culling: IFC faces are not always oriented)
+        self.view.defaultFrameGraph().setFrustumCullingEnabled(True)
         self.container = self.createWindowContainer(self.view)
         self.container.setMinimumSize(QSize(200, 100))
         self.container.setFocusPolicy(Qt.NoFocus)
@@ -108,32 +458,30 @@ class IFCQt3dView(QWidget):
         self.materials.setObjectName("Materials")
         self.materials.setProperty("IsProduct", True)
         self.materials.setParent(self.scene)
-        self.selected = []
-        self.mat_highlight = QGoochMaterial()
-        self.mat_highlight.setObjectName("Shared Highlight Material")
-        self.mat_highlight.setShareable(True)
-        self.mat_highlight.setDiffuse(QColor(50, 250, 50))
-        self.mat_highlight.setShininess(0.5)
-        self.materials.addComponent(self.mat_highlight)
+        self.selected = {}  # from GlobalId to selected QEntity (in order of selection)
+        # the mesh materials are shared per alpha value (see get_mesh_material)
+        self.mesh_effect = create_mesh_effect(False, self.materials)
+        self.transparent_effect = create_mesh_effect(True, self.materials)
+        self.mesh_materials = {}  # from (alpha, highlighted) to the shared QMaterial
 
         self.material = QPerVertexColorMaterial()
         self.material.setObjectName("Shared Vertex Color Material")
         self.material.setShareable(True)
         self.materials.addComponent(self.material)
 
-        self.transparent = QDiffuseSpecularMaterial()
-        self.transparent.setObjectName("Shared Transparent Material")
-        self.transparent.setShareable(True)
-        self.transparent.setAlphaBlendingEnabled(True)
-        self.transparent.setDiffuse(QColor(230, 230, 250, 150))
-        self.materials.addComponent(self.transparent)
-
         self.edge_material = QDiffuseSpecularMaterial()
         self.edge_material.setObjectName("Shared Lines Material")
         self.edge_material.setShareable(True)
         self.edge_material.setDiffuse(QColor(50, 50, 50))
         self.materials.addComponent(self.edge_material)
 
+        # IFC is Z-up and Qt3D is Y-up, all geometry shares the same rotation
+        self.rotation = QTransform()
+        self.rotation.setObjectName("Shared Rotate X -90°")
+        self.rotation.setShareable(True)
+        self.rotation.setRotationX(-90)
+        self.materials.addComponent(self.rotation)
+
         self.camera = None
         self.cam_controller = None
         self.initialise_camera()
@@ -146,6 +494,7 @@ class IFCQt3dView(QWidget):
 
         # Scene Graph
         self.scene_graph = QTreeWidget()
+        self.scene_graph.setUniformRowHeights(True)  # one row per product, all alike
         self.scene_graph.setColumnCount(2)
         self.scene_graph.setHeaderLabels(["Object Name", "Class"])
         # self.scene_graph.selectionModel().selectionChanged.connect(self.toggle_visibility)
@@ -243,31 +592,27 @@ class IFCQt3dView(QWidget):
     # region SelectionMethods
 
     def select_object_by_id(self, object_id):
-        print("IFCQt3dView.select_object_by_id ", object_id)
-        for f in self.files.children():
-            for e in f.children():
-                if e.objectName() == object_id:
-                    self.selected.append(e)
-                    self.set_highlight(e)
-                    return
+        logger.debug("IFCQt3dView.select_object_by_id %s", object_id)
+        e = self.entities.get(object_id)
+        if e is not None:
+            self.selected[object_id] = e
+            self.set_highlight(e)
 
     def deselect_object_by_id(self, object_id):
-        print("IFCQt3dView.deselect_object_by_id ", object_id)
-        for f in self.files.children():
-            for e in f.children():
-                if e.objectName() == object_id:
-                    self.set_highlight(e, False)
-                    if e in self.selected:
-                        self.selected.remove(e)
-                    return
+        logger.debug("IFCQt3dView.deselect_object_by_id %s", object_id)
+        e = self.entities.get(object_id)
+        if e is not None:
+            self.set_highlight(e, False)
+            self.selected.pop(object_id, None)
 
     def toggle_entity(self, entity):
-        print("IFCQt3dView.toggle_entity ", entity.objectName())
-        if entity in self.selected:
-            self.selected.remove(entity)
+        logger.debug("IFCQt3dView.toggle_entity %s", entity.objectName())
+        global_id = entity.objectName()
+        if global_id in self.selected:
+            del self.selected[global_id]
             self.set_highlight(entity, False)
         else:
-            self.selected.append(entity)
+            self.selected[global_id] = entity
             self.set_highlight(entity)
 
     def set_highlight(self, entity, on=True):
@@ -279,35 +624,23 @@ class IFCQt3dView(QWidget):
         :param on: True = set highlight, False = remove
         :param on: bool
         """
-        # Switch the Material from our Mesh Child
-        if on is False:
-            for c in entity.children():
-                c.removeComponent(self.mat_highlight)
-                if c.property("IsTransparent") is True:
-                    c.addComponent(self.transparent)
-                else:
-                    c.addComponent(self.material)
-            self.highlight_in_scene_graph(entity, False)
-        else:
-            for c in entity.children():
-                if c.property("IsTransparent") is True:
-                    c.removeComponent(self.transparent)
-                else:
-                    c.removeComponent(self.material)
-                if c.property("IsWireframe") is True:
-                    c.addComponent(self.material)
-                else:
-                    c.addComponent(self.mat_highlight)
-            self.highlight_in_scene_graph(entity)
+        # Switch the Material from our Mesh Children, keeping their transparency
+        for c in entity.children():
+            alpha = c.property("Alpha")
+            if alpha is None:
+                continue
+            c.removeComponent(self.get_mesh_material(alpha, not on))
+            c.addComponent(self.get_mesh_material(alpha, on))
+        self.highlight_in_scene_graph(entity, on)
 
     def select_exclusive_entity(self, entity):
-        print("IFCQt3dView.select_exclusive_entity ", entity)
-        for e in self.selected:
+        logger.debug("IFCQt3dView.select_exclusive_entity %s", entity)
+        for e in self.selected.values():
             if e is not entity:
                 self.set_highlight(e, False)
                 self.remove_from_selected_entities.emit(e.objectName())
         self.selected.clear()
-        self.selected.append(entity)
+        self.selected[entity.objectName()] = entity
         self.set_highlight(entity)
         self.add_to_selected_entities.emit(entity.objectName())
 
@@ -323,7 +656,7 @@ class IFCQt3dView(QWidget):
         # Picked mesh is child of container entity "parent"
         parent = entity.parentEntity()
         GlobalId = parent.objectName()
-        print("IFCQt3dView.pick (" + GlobalId + ")")
+        logger.debug("IFCQt3dView.pick (%s)", GlobalId)
 
         if e.button() == Qt.LeftButton and e.modifiers() == Qt.ControlModifier:
             self.toggle_entity(parent)
@@ -355,26 +688,23 @@ class IFCQt3dView(QWidget):
     # endregion
 
     def toggle_meshes(self):
-        # Parse the whole Scenegraph and hide all branches with a Triangle Renderer
-
-        # iterate over children
-        for filename, model in self.model_nodes.items():
-            for ifc_entity in model.children():
-                for representation in ifc_entity.children():
-                    # self.update_scene_graph_tree(item, node_item)
-                    if representation.property("IsWireframe") is None:
-                        representation.setEnabled(not representation.isEnabled())
+        # Hide all entities with a Triangle Renderer, as collected in generate_rendermesh
+        for meshes in self.mesh_entities.values():
+            for representation in meshes:
+                representation.setEnabled(not representation.isEnabled())
 
     def toggle_wireframe(self, enabled=True):
-        # Parse the whole Scenegraph and hide all branches with a Lines Renderer
-
-        # iterate over children
-        for filename, model in self.model_nodes.items():
-            for ifc_entity in model.children():
-                for representation in ifc_entity.children():
-                    # self.update_scene_graph_tree(item, node_item)
-                    if representation.property("IsWireframe") is True:
-                        representation.setEnabled(not representation.isEnabled())
+        # Hide the entities with a Lines Renderer, one per model (see generate_edges)
+        self.display_edges = not self.display_edges
+        for lines in self.line_entities.values():
+            lines.setEnabled(self.display_edges)
+        if self.display_edges:
+            # create the edges of models which were loaded while the edges were hidden
+            pending = [filename for filename in self.edge_batches if filename not in self.loaders]
+            for filename in pending:
+                self.generate_edges(filename)
+            if pending:
+                self.update_scene_graph_tree()
 
     # region SceneMethods
 
@@ -492,22 +822,35 @@ class IFCQt3dView(QWidget):
     # region FileMethods
 
     def close_files(self):
+        for filename in list(self.loaders):
+            self.stop_loading(filename)
         for child in self.files.children():
             child.setParent(None)
         self.update_scene_graph_tree()
         self.model_nodes.clear()
+        self.geometry_cache.clear()
+        self.edge_batches.clear()
+        self.mesh_entities.clear()
+        self.line_entities.clear()
+        self.edge_ranges.clear()
+        self.line_indices.clear()
+        self.entities.clear()
         self.selected.clear()
-        pass
+        self.ifc_files.clear()  # so the models can be freed
 
-    def load_file(self, filename):
+    def load_file(self, filename, ifc_file=None):
         """
         Load the file passed as filename and generates the geometry.
         If it already exists, the geometry is removed and recreated.
+        The shared model is only used in the GUI thread: the geometry loader
+        opens its own instance of the file (see IFCGeometryLoader).
 
         :param filename: Full path to the IFC file
+        :param ifc_file: the IFC model, when it was opened already (e.g., shared with other views)
         """
-        ifc_file = None
-        if filename in self.ifc_files:
+        if ifc_file is not None:
+            self.ifc_files[filename] = ifc_file
+        elif filename in self.ifc_files:
             ifc_file = self.ifc_files[filename]
         else:  # Load as new file
             print("Importing IFC file ...")
@@ -516,10 +859,19 @@ class IFCQt3dView(QWidget):
             self.ifc_files[filename] = ifc_file
             print("Loaded in ", time.time() - start)
 
+        self.stop_loading(filename)
+        self.geometry_cache.pop(filename, None)
+        self.edge_batches.pop(filename, None)
+        self.mesh_entities.pop(filename, None)
+        self.line_entities.pop(filename, None)
+        self.edge_ranges.pop(filename, None)
+        self.line_indices.pop(filename, None)
         model_node = None
         if filename in self.model_nodes:
             model_node = self.model_nodes[filename]
             for element in model_node.children():
+                if self.entities.get(element.objectName()) is element:
+                    del self.entities[element.objectName()]
                 element.setParent(None)
         else:
             model_node = QEntity(self.files)
@@ -532,7 +884,8 @@ class IFCQt3dView(QWidget):
         settings = ifcopenshell.geom.settings()
         settings.set(settings.WELD_VERTICES, False)  # false is needed to generate normals -- slower
         # settings.set(settings.NO_NORMALS, True)  # disable generation of normals
-        settings.set(settings.USE_WORLD_COORDS, True)  # true = ignore transformation
+        # false = local coordinates + transformation, so identical shapes can share their buffers
+        settings.set(settings.USE_WORLD_COORDS, False)
         # settings.set(settings.SEW_SHELLS, True)  # true default - slightly slower?
         # settings.set(settings.GENERATE_UVS, True)  # true default
         # settings.set(settings.FASTER_BOOLEANS, True)  # merge opening Booleans before subtracting
@@ -547,15 +900,84 @@ class IFCQt3dView(QWidget):
         # settings.set_angular_tolerance(1)
         # settings.set_deflection_tolerance(1)  # default = 1e-3
 
-        settings.set(settings.USE_PYTHON_OPENCASCADE, True)
+        settings.set(settings.USE_PYTHON_OPENCASCADE, self.use_python_opencascade)
 
         # Two methods
         # self.parse_project(filename, settings)  # SLOWER - create geometry for each product
-        self.parse_geometry(filename, settings)  # FASTER - iteration with parallel processing
+        self.parse_geometry(filename, settings)  # FASTER - iteration with parallel processing, in the background
+
+    def stop_loading(self, filename):
+        """
+        Stop the geometry loader of a file, if it is still running.
+        Batches it has sent already are ignored, see add_shapes.
+        There is no waiting here, as the loader only sees the interruption
+        between two shapes: it is deleted once it has finished.
+
+        :param filename: Full path to the IFC file
+        """
+        loader = self.loaders.pop(filename, None)
+        if loader is not None:
+            loader.shapes_ready.disconnect(self.add_shapes)
+            loader.loading_done.disconnect(self.finish_loading)
+            loader.requestInterruption()
+            loader.finished.connect(loader.deleteLater)
+            if loader.isFinished():
+                loader.deleteLater()  # safe to call more than once
+
+    def wait_for_loaders(self):
+        """
+        Stop all geometry loaders, also those which were stopped before,
+        and wait until they have finished (e.g., before closing the application).
+        """
+        for filename in list(self.loaders):
+            self.stop_loading(filename)
+        for loader in self.findChildren(IFCGeometryLoader):
+            loader.requestInterruption()
+            loader.wait()
+
+    def closeEvent(self, event):
+        # Qt aborts when a thread is destroyed while it is still running
+        self.wait_for_loaders()
+        event.accept()
+
+    def add_shapes(self, loader, batch):
+        """
+        Create the Qt3D entities for a batch of shapes from a geometry loader.
+
+        :param loader: the IFCGeometryLoader which sent the batch
+        :param batch: list of (counter, shape, meshes)
+        """
+        if self.loaders.get(loader.filename) is not loader:
+            return  # the file was reloaded or closed in the meantime
+        parent = self.model_nodes[loader.filename]
+        for counter, shape, meshes in batch:
+            try:
+                self.generate_rendermesh(shape, parent, meshes)
+                print(str("Shape {0}\t[#{1}]\tin {2} seconds")
+                      .format(str(counter), str(shape.data.id), time.time() - self.start))
+            except Exception as e:
+                # not shape.data.product: that entity belongs to the file of the loader thread
+                print(str("Shape {0}\t[#{1}]\tERROR - {2} : {3}")
+                      .format(str(counter), str(shape.data.id), shape.data.type, e))
+
+    def finish_loading(self, loader):
+        """
+        Update the scene graph once all shapes of a file are loaded.
+
+        :param loader: the IFCGeometryLoader which has finished
+        """
+        if self.loaders.get(loader.filename) is not loader:
+            return
+        del self.loaders[loader.filename]
+        loader.wait()  # run() returns right after sending its signal
+        loader.deleteLater()
+        if self.display_edges:  # otherwise, the edges are only created when displayed
+            self.generate_edges(loader.filename)
         print("\nFinished in ", time.time() - self.start)
 
         self.update_scene_graph_tree()
         self.scene_graph.expandToDepth(1)
+        self.geometry_loaded.emit(loader.filename)
 
     # endregion
 
@@ -570,6 +992,9 @@ class IFCQt3dView(QWidget):
                 if entity.property("IsProduct") is True:
                     # TODO: this is the opposite of what we expect...
                     entity.setEnabled(not entity.isEnabled())
+                    # the edges of the product are part of the lines of its model
+                    if entity.parent() is not None:
+                        self.update_edge_visibility(entity.parent().objectName())
                     # set visibility to reflect the check state
                     if tree_item.checkState(0) == Qt.Checked:
                         # if not entity.isEnabled():
@@ -587,41 +1012,56 @@ class IFCQt3dView(QWidget):
         :type entity: QEntity
         :type highlight: bool
         """
-        iterator = QTreeWidgetItemIterator(self.scene_graph)
-        while iterator.value():
-            item = iterator.value()
-            qentity = item.data(0, Qt.UserRole)
-            if entity == qentity:
-                item.setSelected(highlight)
+        item = self.scene_graph_items.get(entity)
+        if item is not None:
+            item.setSelected(highlight)
+            if highlight:
                 self.scene_graph.scrollToItem(item)
-            iterator += 1
 
-    def update_scene_graph_tree(self, node=None, parent=None):
+    def update_scene_graph_tree(self):
         """
-        Recursive update of the tree representing the 3D scene graph.
+        Update of the tree representing the 3D scene graph.
         This only takes the scene_graph itself into account.
         The TreeItems carry a reference to the QEntity node.
         The nodes are named with their IFC Object GlobalId.
         Nodes which represent an IfcProduct (or some grouping),
         get a check box to toggle the visibility of the QEntity.
 
-        :param node: current QEntity
-        :type node: QEntity
-        :param parent: parent QTreeWidgetItem
-        :type parent: QTreeWidgetItem
+        The tree is filled without recursion, adding all children
+        of a node at once, while the tree is not updated on screen.
         """
-        if node is None:
-            node = self.root
-        if parent is None:
-            parent = self.scene_graph.invisibleRootItem()
+        self.scene_graph.setUpdatesEnabled(False)
+        self.scene_graph.blockSignals(True)  # no toggle_visibility while filling in the check states
+        try:
             self.scene_graph.clear()
+            self.scene_graph_items.clear()
+            root_item = self.create_scene_graph_item(self.root)
+            self.scene_graph.addTopLevelItem(root_item)
+            stack = [(self.root, root_item)]
+            while stack:
+                node, node_item = stack.pop()
+                children = node.children()
+                child_items = [self.create_scene_graph_item(child) for child in children]
+                node_item.addChildren(child_items)
+                stack.extend(zip(children, child_items))
+        finally:
+            self.scene_graph.blockSignals(False)
+            self.scene_graph.setUpdatesEnabled(True)
+
+    def create_scene_graph_item(self, node):
+        """
+        Create the (detached) tree item for one node of the scene graph
 
+        :param node: current QEntity
+        :type node: QEntity
+        :return: QTreeWidgetItem
+        """
         node_item = QTreeWidgetItem([node.objectName(), node.metaObject().className()])
-        parent.addChild(node_item)
 
         # Add a reference to the QEntity
         if node.property("IsProduct") is True:
             node_item.setData(0, Qt.UserRole, node)
+            self.scene_graph_items[node] = node_item
             node_item.setData(0, Qt.ToolTipRole, str("{} - {}").format(node.objectName(), "IsProduct"))
 
             # display checkbox for Enabled Items
@@ -631,35 +1071,26 @@ class IFCQt3dView(QWidget):
                 node_item.setCheckState(0, Qt.Unchecked)
             else:
                 node_item.setCheckState(0, Qt.Checked)
-
-        # iterate over children
-        for item in node.children():
-            self.update_scene_graph_tree(item, node_item)
+        return node_item
 
     # endregion
 
     # region GeometryMethods
 
     def parse_geometry(self, filename, settings):
-        ifc_file = self.ifc_files[filename]
-        iterator = ifcopenshell.geom.iterator(settings, ifc_file, multiprocessing.cpu_count())
-        iterator.initialize()
-        counter = 0
-        while True:
-            shape = iterator.get()
-            # skip openings and spaces geometry
-            if not shape.data.product.is_a('IfcOpeningElement') and not shape.data.product.is_a('IfcSpace'):
-                try:
-                    self.generate_rendermesh(shape, self.model_nodes[filename])
-                    print(str("Shape {0}\t[#{1}]\tin {2} seconds")
-                          .format(str(counter), str(shape.data.id), time.time() - self.start))
-                except Exception as e:
-                    print(str("Shape {0}\t[#{1}]\tERROR - {2} : {3}")
-                          .format(str(counter), str(shape.data.id), shape.data.product.is_a(), e))
-                    pass
-            counter += 1
-            if not iterator.next():
-                break
+        """
+        Start a background IFCGeometryLoader for the file.
+        The shapes are added by add_shapes while the loader is running.
+        The loader reads its own instance of the file, never the model in ifc_files.
+
+        :param filename: Full path to the IFC file
+        :param settings: ifcopenshell.geom.settings for the iterator
+        """
+        loader = IFCGeometryLoader(filename, settings, self.tessellate, parent=self)
+        loader.shapes_ready.connect(self.add_shapes)
+        loader.loading_done.connect(self.finish_loading)
+        self.loaders[filename] = loader
+        loader.start()
 
     def parse_project(self, filename, settings):
         ifc_file = self.ifc_files[filename]
@@ -669,242 +1100,363 @@ class IFCQt3dView(QWidget):
         for product in products:
             if not product.is_a('IfcOpeningElement') and not product.is_a('IfcSpace'):
                 if product.Representation:
-                    shape = ifcopenshell.geom.create_shape(settings, product)
+                    shape = wrap_shape(ifcopenshell.geom.create_shape(settings, product))
                     self.generate_rendermesh(shape, self.model_nodes[filename])
                     print(str("Product {0}\t[#{1}]\tin {2} seconds")
                           .format(str(counter), str(product.id()), time.time() - self.start))
             counter += 1
+        if self.display_edges:  # otherwise, the edges are only created when displayed
+            self.generate_edges(filename)
 
     def parse_shape(self, geometry):
+        """
+        Tessellate an OCC shape and return its mesh data as flat numpy arrays,
+        which can be passed to a QBuffer as-is.
+
+        :param geometry: TopoDS Shape (from OpenCASCADE)
+        :return: vertices, normals, edges (float32) and triangles (uint32)
+        """
         # compute the tessellation
         tess = ShapeTesselator(geometry)
         tess.Compute(compute_edges=True)
         # tess.Compute(compute_edges=False, mesh_quality=1.0, parallel=True)
 
-        # get the vertices
-        vertices = []
-        vertex_count = tess.ObjGetVertexCount()
-        for i_vertex in range(0, vertex_count):
-            i1, i2, i3 = tess.GetVertex(i_vertex)
-            vertices.append(i1)
-            vertices.append(i2)
-            vertices.append(i3)
-
-        # get the normals
-        normals = []
-        normals_count = tess.ObjGetNormalCount()
-        for i_normal in range(0, normals_count):
-            i1, i2, i3 = tess.GetNormal(i_normal)
-            normals.append(i1)
-            normals.append(i2)
-            normals.append(i3)
-
-        # get the triangles
-        triangles = []
-        triangle_count = tess.ObjGetTriangleCount()
-        for i_triangle in range(0, triangle_count):
-            i1, i2, i3 = tess.GetTriangleIndex(i_triangle)
-            triangles.append(i1)
-            triangles.append(i2)
-            triangles.append(i3)
-
-        # get the edges
-        edges = []
+        # get all corners of all triangles, with a single call instead of one per vertex
+        corners = np.asarray(tess.GetVerticesPositionAsTuple(), dtype=np.float32).reshape(-1, 3)
+        corner_normals = np.asarray(tess.GetNormalsAsTuple(), dtype=np.float32).reshape(-1, 3)
+        if len(corner_normals) == len(corners):
+            corners = np.hstack([corners, corner_normals])
+
+        # the corners repeat the vertices shared by triangles, so index them again
+        unique_corners, triangles = np.unique(corners, axis=0, return_inverse=True)
+        vertices = unique_corners[:, :3].ravel()
+        normals = unique_corners[:, 3:].ravel()
+        triangles = triangles.ravel().astype(np.uint32)
+
+        # get the edges (all vertices of all edges, one after the other)
         edge_count = tess.ObjGetEdgeCount()
-        for i_edge in range(0, edge_count):
-            vertex_count = tess.ObjEdgeGetVertexCount(i_edge)
-            # edge = []
-            for i_vertex in range(0, vertex_count):
-                vertex = tess.GetEdgeVertex(i_edge, i_vertex)
-                # edge.append(vertex)
-                # edges.append(i_vertex)
-                edges.append(vertex[0])
-                edges.append(vertex[1])
-                edges.append(vertex[2])
-            # edges.append(edge)
+        edge_vertex_counts = [tess.ObjEdgeGetVertexCount(i_edge) for i_edge in range(edge_count)]
+        edges = np.fromiter(itertools.chain.from_iterable(
+            tess.GetEdgeVertex(i_edge, i_vertex)
+            for i_edge, edge_vertex_count in enumerate(edge_vertex_counts)
+            for i_vertex in range(edge_vertex_count)),
+            dtype=np.float32, count=sum(edge_vertex_counts) * 3)
 
         return vertices, normals, triangles, edges
 
-    def generate_rendermesh(self, shape, parent):
+    def parse_triangulation(self, geometry):
+        """
+        Return the mesh data for the triangulation from IfcOpenShell,
+        with one mesh for each material. The edges are added to the first mesh.
+
+        :param geometry: Triangulation from ifcopenshell.geom
+        :return: list of vertices, normals, triangles, edges and rgba color
+        """
+        vertices = np.asarray(geometry.verts, dtype=np.float32).reshape(-1, 3)
+        normals = np.asarray(geometry.normals, dtype=np.float32).reshape(-1, 3)
+        faces = np.asarray(geometry.faces, dtype=np.uint32).reshape(-1, 3)
+        edges = vertices[np.asarray(geometry.edges, dtype=np.uint32)].ravel()
+        material_ids = np.asarray(geometry.material_ids, dtype=np.int32)
+        materials = geometry.materials
+
+        meshes = []
+        for material_id in np.unique(material_ids):
+            if material_id < 0:
+                color = DEFAULT_COLOR
+            else:
+                material = materials[material_id]
+                alpha = 1.0 - material.transparency if material.has_transparency else 1.0
+                color = tuple(material.diffuse) + (alpha,)
+            # only keep the vertices used by the triangles of this material
+            used, triangles = np.unique(faces[material_ids == material_id], return_inverse=True)
+            sub_normals = normals[used].ravel() if len(normals) else normals.ravel()
+            meshes.append((vertices[used].ravel(), sub_normals, triangles.ravel().astype(np.uint32),
+                           edges if not meshes else edges[:0], color))
+        return meshes
+
+    def tessellate(self, shape):
         """
-        Collecting the mesh geometry using OCC for the current TopoDS Shape.
+        Return the mesh data of a shape as a list of mesh_tuple (see pack_mesh),
+        with one mesh for each transparency.
+        This does not touch any Qt objects, so it can run in a background thread.
+
+        :param shape: shape_tuple, with either a TopoDS Shape (from OpenCASCADE)
+            or the triangulation from IfcOpenShell as geometry
+        """
+        if shape.styles is None:
+            return merge_meshes(self.parse_triangulation(shape.geometry))
+        meshes = []
+        it = OCC.Core.TopoDS.TopoDS_Iterator(shape.geometry)
+        index = 0
+        while it.More():
+            # we get a list of styles (ids) and surface styles (rgba values)
+            # expressed per shape, not per vertex
+            meshes.append(self.parse_shape(it.Value()) + (tuple(shape.styles[index][:4]),))
+            index += 1
+            it.Next()
+        return merge_meshes(meshes)
+
+    def get_mesh_material(self, alpha, highlighted=False):
+        """
+        Return the shared material for meshes with the given transparency.
+        The materials only differ in their parameters, as they share the same effect.
+
+        :param float alpha: 1.0 = opaque, lower values are transparent
+        :param bool highlighted: True = the material for selected meshes
+        :return: QMaterial
+        """
+        key = (round(alpha, 3), highlighted)
+        material = self.mesh_materials.get(key)
+        if material is None:
+            material = QMaterial()
+            material.setObjectName(str("Shared Mesh Material {} {}").format(*key))
+            material.setShareable(True)
+            material.setEffect(self.transparent_effect if alpha < 1.0 else self.mesh_effect)
+            material.addParameter(QParameter("alpha", alpha))
+            material.addParameter(QParameter("highlighted", highlighted))
+            self.materials.addComponent(material)
+            self.mesh_materials[key] = material
+        return material
+
+    def generate_rendermesh(self, shape, parent, meshes=None):
+        """
+        Collecting the mesh geometry for the current shape (see tessellate).
         The vertices, edges, triangles and colors are used to create the
         Qt3D Entities & Nodes & Components for the 3D Representation.
 
-        :param shape: TopoDS Shape (from OpenCASCADE)
+        :param shape: shape_tuple (see wrap_shape)
         :param parent: QEntity parent Node (representing the File node)
+        :param meshes: mesh data from tessellate, computed here when not given
         """
-        data = shape.data
-        geometry = shape.geometry
-        styles = shape.styles
-        style_ids = shape.style_ids
-
         custom_mesh_entity = QEntity(parent)
         custom_mesh_entity.setObjectName(shape.data.guid)
         custom_mesh_entity.setProperty("IsProduct", True)
         custom_mesh_entity.setProperty("GlobalId", shape.data.guid)
+        self.entities[shape.data.guid] = custom_mesh_entity
+        # the meshes are in local coordinates, placed by the transformation of the product
+        placement = get_placement(shape)
+        transform = QTransform()
+        transform.setObjectName("Placement")
+        transform.setMatrix(self.rotation.matrix() * QMatrix4x4(*placement.ravel().tolist()))
+        custom_mesh_entity.addComponent(transform)
 
-        it = OCC.Core.TopoDS.TopoDS_Iterator(geometry)
-        index = 0
-        while it.More():
-            vertices, normals, triangles, edges = self.parse_shape(it.Value())
+        # renderers which can be shared within this file
+        cache = self.geometry_cache.setdefault(parent.objectName(), {})
+        mesh_entities = self.mesh_entities.setdefault(parent.objectName(), [])
 
+        if meshes is None:
+            meshes = self.tessellate(shape)
+        for key, vertex_data, triangles, edges, a in meshes:
             # ------ MESH --------------------------
-            custom_mesh_renderer = QGeometryRenderer()
-            custom_mesh_renderer.setObjectName("Mesh Renderer")
-            custom_mesh_renderer.setPrimitiveType(QGeometryRenderer.Triangles)
-            custom_geometry = QGeometry(custom_mesh_renderer)
-            custom_geometry.setObjectName("Custom Geometry")
-
-            # Position Attribute
-            position_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
-            # position_data_buffer.setData(QByteArray(np.array(geometry.verts).astype(np.float32).tobytes()))
-            position_data_buffer.setData(struct.pack('%sf' % len(vertices), *vertices))
-            position_attribute = QAttribute()
-            position_attribute.setAttributeType(QAttribute.VertexAttribute)
-            position_attribute.setBuffer(position_data_buffer)
-            position_attribute.setVertexBaseType(QAttribute.Float)
-            position_attribute.setVertexSize(3)  # 3 floats
-            position_attribute.setByteOffset(0)  # start from first index
-            position_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
-            position_attribute.setCount(len(vertices))  # vertices
-            position_attribute.setName(QAttribute.defaultPositionAttributeName())
-            position_attribute.setObjectName("Position Vertex Attribute")
-            custom_geometry.addAttribute(position_attribute)
-
-            # Normal Attribute
-            if len(normals) > 0:
-                normals_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
-                # normals_data_buffer.setData(QByteArray(np.array(geometry.normals).astype(np.float32).tobytes()))
-                normals_data_buffer.setData(struct.pack('%sf' % len(normals), *normals))
-                normal_attribute = QAttribute()
-                normal_attribute.setAttributeType(QAttribute.VertexAttribute)
-                normal_attribute.setBuffer(normals_data_buffer)
-                normal_attribute.setVertexBaseType(QAttribute.Float)
-                normal_attribute.setVertexSize(3)  # 3 floats
-                normal_attribute.setByteOffset(0)  # start from first index
-                normal_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
-                normal_attribute.setCount(len(normals))  # vertices
-                normal_attribute.setName(QAttribute.defaultNormalAttributeName())
-                normal_attribute.setObjectName("Normal Vertex Attribute")
-                custom_geometry.addAttribute(normal_attribute)
-
-            # Collect the colors via the materials (1 color per vertex)
-            # we get a list of styles (ids) and surface styles (rgba values)
-            # expressed per shape, not per vertex, so repeat them
-            s_style = styles[index]
-            r = s_style[0]
-            g = s_style[1]
-            b = s_style[2]
-            a = s_style[3]
-            color_list = [r, g, b] * int(len(vertices) / 3)
-
-            # Color Attribute
-            color_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
-            # color_data_buffer.setData(QByteArray(np.array(color_list).astype(np.float32).tobytes()))
-            color_data_buffer.setData(struct.pack('%sf' % len(color_list), *color_list))
-            color_attribute = QAttribute()
-            color_attribute.setAttributeType(QAttribute.VertexAttribute)
-            color_attribute.setBuffer(color_data_buffer)
-            color_attribute.setVertexBaseType(QAttribute.Float)
-            color_attribute.setVertexSize(3)  # 3 floats
-            color_attribute.setByteOffset(0)  # start from first index
-            color_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
-            color_attribute.setCount(len(color_list))  # colors (per vertex)
-            color_attribute.setName(QAttribute.defaultColorAttributeName())
-            color_attribute.setObjectName("Color Vertex Attribute")
-            custom_geometry.addAttribute(color_attribute)
-
-            # Faces Index Attribute
-            index_data_buffer = QBuffer(QBuffer.IndexBuffer, custom_geometry)
-            # index_data_buffer.setData(QByteArray(np.array(triangles).astype(np.uintc).tobytes()))
-            index_data_buffer.setData(struct.pack("{}I".format(len(triangles)), *triangles))
-            index_data_buffer.setObjectName("Index Data Buffer")
-            index_attribute = QAttribute()
-            index_attribute.setVertexBaseType(QAttribute.UnsignedInt)
-            index_attribute.setAttributeType(QAttribute.IndexAttribute)
-            index_attribute.setBuffer(index_data_buffer)
-            index_attribute.setCount(len(triangles))
-            index_attribute.setName("Indices")
-            index_attribute.setObjectName("Index Unsigned Int Attribute")
-            custom_geometry.addAttribute(index_attribute)
-
-            # make the geometry visible with a renderer
-            custom_mesh_renderer.setGeometry(custom_geometry)
-            custom_mesh_renderer.setInstanceCount(1)
-            custom_mesh_renderer.setFirstVertex(0)
-            custom_mesh_renderer.setFirstInstance(0)
+            # identical meshes (e.g., from mapped items or types) share a single renderer
+            custom_mesh_renderer = cache.get(key)
+            if custom_mesh_renderer is None:
+                custom_mesh_renderer = self.create_mesh_renderer(vertex_data, triangles)
+                cache[key] = custom_mesh_renderer
 
             # add everything to the scene
             custom_mesh_sub_entity = QEntity(custom_mesh_entity)
             custom_mesh_sub_entity.addComponent(custom_mesh_renderer)
             custom_mesh_sub_entity.setObjectName("Mesh")  # ifc_object.GlobalId)
-            transform = QTransform()
-            transform.setObjectName("Rotate X -90°")
-            transform.setRotationX(-90)
-            custom_mesh_sub_entity.addComponent(transform)
+            custom_mesh_sub_entity.setProperty("Alpha", a)
             if a < 1.0:
-                custom_mesh_sub_entity.addComponent(self.transparent)
                 custom_mesh_sub_entity.setProperty("IsTransparent", True)
-            else:
-                custom_mesh_sub_entity.addComponent(self.material)
+            custom_mesh_sub_entity.addComponent(self.get_mesh_material(a))
+            mesh_entities.append(custom_mesh_sub_entity)
 
             # ------ EDGES --------------------------
-            custom_line_renderer = QGeometryRenderer()
-            custom_line_renderer.setObjectName("Lines Renderer")
-            custom_line_renderer.setPrimitiveType(QGeometryRenderer.Lines)
-            custom_line_geometry = QGeometry(custom_line_renderer)
-            custom_line_geometry.setObjectName("Custom Lines Geometry")
-
-            # Position Attribute
-            position_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_line_geometry)
-            # position_data_buffer.setData(QByteArray(np.array(edges).astype(np.float32).tobytes()))
-            position_data_buffer.setData(struct.pack('%sf' % len(edges), *edges))
-            position_attribute = QAttribute()
-            position_attribute.setAttributeType(QAttribute.VertexAttribute)
-            position_attribute.setBuffer(position_data_buffer)
-            position_attribute.setVertexBaseType(QAttribute.Float)
-            position_attribute.setVertexSize(3)  # 3 floats
-            position_attribute.setByteOffset(0)  # start from first index
-            position_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
-            position_attribute.setCount(len(edges))  # vertices
-            position_attribute.setName(QAttribute.defaultPositionAttributeName())
-            custom_line_geometry.addAttribute(position_attribute)
-
-            # Edges Index Attribute
-            indices_edges = list(range(int(len(edges) / 3)))
-            index_data_buffer = QBuffer(QBuffer.IndexBuffer, custom_line_geometry)
-            # index_data_buffer.setData(QByteArray(np.array(indices_edges).astype(np.uintc).tobytes()))
-            index_data_buffer.setData(struct.pack("{}I".format(len(indices_edges)), *indices_edges))
-            index_data_buffer.setObjectName("Index Data Buffer")
-            index_attribute = QAttribute()
-            index_attribute.setVertexBaseType(QAttribute.UnsignedInt)
-            index_attribute.setAttributeType(QAttribute.IndexAttribute)
-            index_attribute.setBuffer(index_data_buffer)
-            index_attribute.setCount(len(indices_edges))
-            index_attribute.setName("Indices")
-            index_attribute.setObjectName("Index Unsigned Int Attribute")
-            custom_line_geometry.addAttribute(index_attribute)
-
-            # make the geometry visible with a renderer
-            custom_line_renderer.setGeometry(custom_line_geometry)
-            custom_line_renderer.setInstanceCount(1)
-            custom_line_renderer.setFirstVertex(0)
-            custom_line_renderer.setFirstInstance(0)
+            # collected for the whole model (in world coordinates), see generate_edges
+            if len(edges) > 0:
+                edges = edges.reshape(-1, 3) @ placement[:3, :3].T + placement[:3, 3]
+                self.edge_batches.setdefault(parent.objectName(), []).append(
+                    (shape.data.guid, edges.astype(np.float32).ravel()))
 
-            # add everything to the scene
-            custom_line_entity = QEntity(custom_mesh_entity)  # TODO: rethink scenegraph
-            custom_line_entity.setObjectName("Line")
-            custom_line_entity.setProperty("IsWireframe", True)
-            transform = QTransform()
-            transform.setObjectName("Rotate X -90°")
-            transform.setRotationX(-90)
-            custom_line_entity.addComponent(transform)
-            custom_line_entity.addComponent(custom_line_renderer)
-            custom_line_entity.addComponent(self.edge_material)
+    def generate_edges(self, filename):
+        """
+        Create a single line entity with the edges of all shapes of a model,
+        so they are drawn at once instead of with one draw call per shape.
+        The range of each product in the line indices is kept, so the edges
+        of hidden products can be left out (see update_edge_visibility).
 
-            index += 1
-            it.Next()
+        :param filename: Full path to the IFC file
+        """
+        edges = self.edge_batches.pop(filename, None)
+        if not edges:
+            return
+        ranges = {}
+        start = 0
+        for guid, product_edges in edges:
+            end = start + len(product_edges) // 3  # one index per end point
+            ranges.setdefault(guid, []).append((start, end))
+            start = end
+        custom_line_renderer, indices, index_attribute = self.create_line_renderer(
+            np.concatenate([product_edges for guid, product_edges in edges]))
+        self.edge_ranges[filename] = ranges
+        self.line_indices[filename] = (indices, index_attribute)
+
+        # add everything to the scene
+        custom_line_entity = QEntity(self.model_nodes[filename])
+        custom_line_entity.setObjectName("Lines")
+        custom_line_entity.setProperty("IsWireframe", True)
+        custom_line_entity.setEnabled(self.display_edges)
+        custom_line_entity.addComponent(self.rotation)
+        custom_line_entity.addComponent(custom_line_renderer)
+        custom_line_entity.addComponent(self.edge_material)
+        self.line_entities[filename] = custom_line_entity
+        self.update_edge_visibility(filename)  # products may have been hidden already
+
+    def update_edge_visibility(self, filename):
+        """
+        Leave the edges of hidden products out of the lines of a model,
+        by rebuilding its index buffer from the ranges of the visible products.
+
+        :param filename: Full path to the IFC file
+        """
+        ranges = self.edge_ranges.get(filename)
+        if ranges is None:
+            return  # no edges (yet)
+        indices, index_attribute = self.line_indices[filename]
+        visible = np.ones(len(indices), dtype=bool)
+        for guid, product_ranges in ranges.items():
+            entity = self.entities.get(guid)
+            if entity is not None and not entity.isEnabled():
+                for start, end in product_ranges:
+                    visible[start:end] = False
+        shown_indices = indices if visible.all() else indices[visible]
+        index_attribute.buffer().setData(shown_indices.tobytes())
+        index_attribute.setCount(len(shown_indices))
+
+    def create_mesh_renderer(self, vertex_data, triangles):
+        """
+        Create the renderer for a triangle mesh with a color per vertex.
+
+        :param vertex_data: structured array with position, normal (optional) and color
+        :param triangles: flat uint16 or uint32 array of vertex indices
+        :return: QGeometryRenderer
+        """
+        custom_mesh_renderer = QGeometryRenderer()
+        custom_mesh_renderer.setObjectName("Mesh Renderer")
+        custom_mesh_renderer.setPrimitiveType(QGeometryRenderer.Triangles)
+        custom_geometry = QGeometry(custom_mesh_renderer)
+        custom_geometry.setObjectName("Custom Geometry")
+
+        # Positions, normals and colors are interleaved in a single buffer (see pack_mesh)
+        vertex_count = len(vertex_data)
+        has_normals = 'normal' in vertex_data.dtype.names
+        stride = vertex_data.dtype.itemsize
+        vertex_data_buffer = create_static_buffer(QBuffer.VertexBuffer, vertex_data.tobytes(), custom_geometry)
+        vertex_data_buffer.setObjectName("Vertex Data Buffer")
+
+        # Position Attribute
+        position_attribute = QAttribute()
+        position_attribute.setAttributeType(QAttribute.VertexAttribute)
+        position_attribute.setBuffer(vertex_data_buffer)
+        position_attribute.setVertexBaseType(QAttribute.Float)
+        position_attribute.setVertexSize(3)  # 3 floats
+        position_attribute.setByteOffset(0)  # start from first index
+        position_attribute.setByteStride(stride)
+        position_attribute.setCount(vertex_count)  # vertices
+        position_attribute.setName(QAttribute.defaultPositionAttributeName())
+        position_attribute.setObjectName("Position Vertex Attribute")
+        custom_geometry.addAttribute(position_attribute)
+
+        # Normal Attribute
+        if has_normals:
+            normal_attribute = QAttribute()
+            normal_attribute.setAttributeType(QAttribute.VertexAttribute)
+            normal_attribute.setBuffer(vertex_data_buffer)
+            normal_attribute.setVertexBaseType(QAttribute.Float)
+            normal_attribute.setVertexSize(3)  # 3 floats
+            normal_attribute.setByteOffset(3 * 4)  # after the position
+            normal_attribute.setByteStride(stride)
+            normal_attribute.setCount(vertex_count)  # vertices
+            normal_attribute.setName(QAttribute.defaultNormalAttributeName())
+            normal_attribute.setObjectName("Normal Vertex Attribute")
+            custom_geometry.addAttribute(normal_attribute)
+
+        # Color Attribute
+        color_attribute = QAttribute()
+        color_attribute.setAttributeType(QAttribute.VertexAttribute)
+        color_attribute.setBuffer(vertex_data_buffer)
+        color_attribute.setVertexBaseType(QAttribute.UnsignedByte)  # normalized to 0..1 in the shader
+        color_attribute.setVertexSize(4)  # 4 bytes
+        color_attribute.setByteOffset(stride - 4)  # last 4 bytes of each vertex
+        color_attribute.setByteStride(stride)
+        color_attribute.setCount(vertex_count)  # colors (per vertex)
+        color_attribute.setName(QAttribute.defaultColorAttributeName())
+        color_attribute.setObjectName("Color Vertex Attribute")
+        custom_geometry.addAttribute(color_attribute)
+
+        # Faces Index Attribute
+        index_data_buffer = create_static_buffer(QBuffer.IndexBuffer, triangles.tobytes(), custom_geometry)
+        index_data_buffer.setObjectName("Index Data Buffer")
+        index_attribute = QAttribute()
+        index_attribute.setVertexBaseType(get_index_type(triangles))
+        index_attribute.setAttributeType(QAttribute.IndexAttribute)
+        index_attribute.setBuffer(index_data_buffer)
+        index_attribute.setCount(len(triangles))
+        index_attribute.setName("Indices")
+        index_attribute.setObjectName("Index Attribute")
+        custom_geometry.addAttribute(index_attribute)
+
+        # make the geometry visible with a renderer
+        custom_mesh_renderer.setGeometry(custom_geometry)
+        custom_mesh_renderer.setInstanceCount(1)
+        custom_mesh_renderer.setFirstVertex(0)
+        custom_mesh_renderer.setFirstInstance(0)
+        return custom_mesh_renderer
+
+    def create_line_renderer(self, edges):
+        """
+        Create the renderer for the edges of a mesh, drawn as separate lines.
+        The end points shared by several edges are only stored once, so the
+        index buffer is needed (it is not simply 0..N-1).
+
+        :param edges: flat float32 array of the coordinates of the edge vertices
+        :return: QGeometryRenderer, the line indices (one per end point, in the order of edges)
+                 and the index QAttribute
+        """
+        # edges share their end points, so only keep each point once and refer to it by index
+        points, indices_edges = np.unique(edges.reshape(-1, 3), axis=0, return_inverse=True)
+        indices_edges = compact_indices(indices_edges.ravel(), len(points))
+
+        custom_line_renderer = QGeometryRenderer()
+        custom_line_renderer.setObjectName("Lines Renderer")
+        custom_line_renderer.setPrimitiveType(QGeometryRenderer.Lines)
+        custom_line_geometry = QGeometry(custom_line_renderer)
+        custom_line_geometry.setObjectName("Custom Lines Geometry")
+
+        # Position Attribute
+        position_data_buffer = create_static_buffer(QBuffer.VertexBuffer, points.tobytes(), custom_line_geometry)
+        position_attribute = QAttribute()
+        position_attribute.setAttributeType(QAttribute.VertexAttribute)
+        position_attribute.setBuffer(position_data_buffer)
+        position_attribute.setVertexBaseType(QAttribute.Float)
+        position_attribute.setVertexSize(3)  # 3 floats
+        position_attribute.setByteOffset(0)  # start from first index
+        position_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
+        position_attribute.setCount(len(points))  # vertices
+        position_attribute.setName(QAttribute.defaultPositionAttributeName())
+        custom_line_geometry.addAttribute(position_attribute)
+
+        # Edges Index Attribute
+        index_data_buffer = create_static_buffer(QBuffer.IndexBuffer, indices_edges.tobytes(), custom_line_geometry)
+        index_data_buffer.setObjectName("Index Data Buffer")
+        index_attribute = QAttribute()
+        index_attribute.setVertexBaseType(get_index_type(indices_edges))
+        index_attribute.setAttributeType(QAttribute.IndexAttribute)
+        index_attribute.setBuffer(index_data_buffer)
+        index_attribute.setCount(len(indices_edges))
+        index_attribute.setName("Indices")
+        index_attribute.setObjectName("Index Attribute")
+        custom_line_geometry.addAttribute(index_attribute)
+
+        # make the geometry visible with a renderer
+        custom_line_renderer.setGeometry(custom_line_geometry)
+        custom_line_renderer.setInstanceCount(1)
+        custom_line_renderer.setFirstVertex(0)
+        custom_line_renderer.setFirstInstance(0)
+        return custom_line_renderer, indices_edges, index_attribute
 
     def generate_line(self, start, end):
         vertices = start + end
@@ -929,56 +1481,65 @@ class IFCQt3dView(QWidget):
         elif type(pos) == QVector3D:
             pos = [pos.x(), pos.y(), pos.z()]
         x, y, z = pos[0], pos[1], pos[2]
-        for h in range(-extent, extent + step_size, step_size):
-            grid_line = [x + h, y - extent, z, x + h, y + extent, z]
-            self.generate_primitive(grid_line)
-        for v in range(-extent, extent + step_size, step_size):
-            grid_line = [x - extent, y + v, z, x + extent, y + v, z]
-            self.generate_primitive(grid_line)
+        # all grid lines in a single primitive: 2 points of 3 coordinates per line
+        steps = np.arange(-extent, extent + step_size, step_size, dtype=np.float32)
+        n = len(steps)
+        grid_lines = np.empty((2 * n, 2, 3), dtype=np.float32)
+        grid_lines[:, :, 2] = z
+        # lines along Y
+        grid_lines[:n, :, 0] = (x + steps)[:, np.newaxis]
+        grid_lines[:n, 0, 1] = y - extent
+        grid_lines[:n, 1, 1] = y + extent
+        # lines along X
+        grid_lines[n:, 0, 0] = x - extent
+        grid_lines[n:, 1, 0] = x + extent
+        grid_lines[n:, :, 1] = (y + steps)[:, np.newaxis]
+        self.generate_primitive(grid_lines)
 
     def generate_primitive(self,
                            coordinates,
                            colors=None,
                            primitive=QGeometryRenderer.Lines):
-        # coordinates = [x1, y1, z1, x2, y2, z2, ...]
+        # coordinates = [x1, y1, z1, x2, y2, z2, ...] (as list or numpy array)
         if colors is None:
             colors = [0.5, 0.5, 0.5]
-        if len(colors) != len(coordinates):
-            color_list = colors * int(len(coordinates) / len(colors))
-        else:
-            color_list = colors
+        coordinates = np.asarray(coordinates, dtype=np.float32)
+        color_list = np.asarray(colors, dtype=np.float32)
+        if color_list.size != coordinates.size:
+            # a single color for all vertices, repeated without building a list
+            color_list = np.broadcast_to(color_list, (coordinates.size // 3, 3))
 
         custom_line_renderer = QGeometryRenderer()
         custom_line_renderer.setPrimitiveType(primitive)
         custom_geometry = QGeometry(custom_line_renderer)
 
+        # Interleave positions and colors in a single buffer (1 row per vertex)
+        vertex_count = coordinates.size // 3
+        vertex_data = np.hstack([coordinates.reshape(-1, 3), color_list.reshape(-1, 3)])
+        stride = 6 * 4  # 6 floats and 4 as length of float32 in bytes
+        vertex_data_buffer = create_static_buffer(QBuffer.VertexBuffer, vertex_data.tobytes(), custom_geometry)
+
         # Position Attribute
-        position_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
-        # position_data_buffer.setData(QByteArray(np.array(coordinates).astype(np.float32).tobytes()))
-        position_data_buffer.setData(struct.pack('%sf' % len(coordinates), *coordinates))
         position_attribute = QAttribute()
-        # position_attribute.setAttributeType(QAttribute.VertexAttribute)
-        position_attribute.setBuffer(position_data_buffer)
-        # position_attribute.setVertexBaseType(QAttribute.Float)
+        position_attribute.setAttributeType(QAttribute.VertexAttribute)
+        position_attribute.setBuffer(vertex_data_buffer)
+        position_attribute.setVertexBaseType(QAttribute.Float)
         position_attribute.setVertexSize(3)  # 3 floats
-        # position_attribute.setByteOffset(0)  # start from first index
-        # position_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
-        # position_attribute.setCount(len(coordinates))  # vertices
+        position_attribute.setByteOffset(0)  # start from first index
+        position_attribute.setByteStride(stride)
+        position_attribute.setCount(vertex_count)  # vertices
         position_attribute.setName(QAttribute.defaultPositionAttributeName())
         custom_geometry.addAttribute(position_attribute)
 
         # Color Attribute
-        color_data_buffer = QBuffer(QBuffer.VertexBuffer, custom_geometry)
-        # color_data_buffer.setData(QByteArray(np.array(color_list).astype(np.float32).tobytes()))
-        color_data_buffer.setData(struct.pack('%sf' % len(color_list), *color_list))
         color_attribute = QAttribute()
-        # color_attribute.setAttributeType(QAttribute.VertexAttribute)
-        color_attribute.setBuffer(color_data_buffer)
-        # color_attribute.setVertexBaseType(QAttribute.Float)
+        color_attribute.setAttributeType(QAttribute.VertexAttribute)
+        color_attribute.setBuffer(vertex_data_buffer)
+        color_attribute.setVertexBaseType(QAttribute.Float)
         color_attribute.setVertexSize(3)  # 3 floats
-        # color_attribute.setByteOffset(0)  # start from first index
-        # color_attribute.setByteStride(3 * 4)  # 3 coordinates and 4 as length of float32 in bytes
-        color_attribute.setCount(len(color_list))  # colors (per vertex)
+        color_attribute.setByteOffset(3 * 4)  # after the position
+        color_attribute.setByteStride(stride)
+        color_attribute.setCount(vertex_count)  # colors (per vertex)
         color_attribute.setName(QAttribute.defaultColorAttributeName())
         custom_geometry.addAttribute(color_attribute)
 
@@ -992,10 +1553,7 @@ class IFCQt3dView(QWidget):
         # add everything to the scene
         custom_line_entity = QEntity(self.grids)
         custom_line_entity.setObjectName("Line")
-        transform = QTransform()
-        transform.setObjectName("Rotate X -90°")
-        transform.setRotationX(-90)
-        custom_line_entity.addComponent(transform)
+        custom_line_entity.addComponent(self.rotation)
         custom_line_entity.addComponent(custom_line_renderer)
         custom_line_entity.addComponent(self.material)
 
@@ -1,5 +1,6 @@
 import sys
 import os.path
+import logging
 
 try:
     from PyQt5.QtCore import *
@@ -13,6 +14,9 @@ except Exception:
 import ifcopenshell
 from IFCCustomDelegate import *
 
+# selection messages are only shown when debug logging is enabled
+logger = logging.getLogger(__name__)
+
 
 class IFCTreeWidget(QWidget):
     """
@@ -24,11 +28,30 @@ class IFCTreeWidget(QWidget):
     - V5 = Editing the name of objects + keeping multiple files in a dictionary
     - V6 = Spinning off the property tree into its own widget
     - V7 = Make the tree configurable (Decomposition, Root Class Chooser)
+    - V8 = Only fill deeper branches of the tree when they are expanded
     """
     def __init__(self):
         QWidget.__init__(self)
         # A dictionary referring to our files, based on name
         self.ifc_files = {}
+        # A dictionary from GlobalId to the tree items of that object (can appear more than once)
+        self.object_items = {}
+        # A dictionary from STEP id to the tree items of objects without GlobalId (in any of the files)
+        self.step_items = {}
+        # A dictionary from filename to the top level item of that file
+        self.file_items = {}
+        # A dictionary from filename to the children of the objects in that file (see index_children)
+        self.children_indices = {}
+        # Selection changes which are not sent yet, as GlobalIds (dictionaries keep the order)
+        self.pending_selected = {}
+        self.pending_deselected = {}
+        # Selection changes are sent together, e.g. while dragging a selection
+        self.selection_timer = QTimer(self)
+        self.selection_timer.setSingleShot(True)
+        self.selection_timer.setInterval(50)
+        self.selection_timer.timeout.connect(self.flush_selection)
+        # The items of which the children are not added yet (see fetch_children)
+        self.pending_items = []
 
         # Main Settings
         self.root_class = 'IfcProject'
@@ -70,6 +93,7 @@ class IFCTreeWidget(QWidget):
 
         # Object Tree
         self.object_tree = QTreeWidget()
+        self.object_tree.setUniformRowHeights(True)  # no need to measure each row
         vbox.addWidget(self.object_tree)
         self.object_tree.setColumnCount(2)
         self.object_tree.setHeaderLabels(["Name", "Class"])
@@ -77,62 +101,122 @@ class IFCTreeWidget(QWidget):
         self.object_tree.selectionModel().selectionChanged.connect(self.send_selection)
         self.object_tree.itemDoubleClicked.connect(self.check_object_name_edit)
         self.object_tree.itemChanged.connect(self.set_object_name_edit)
+        self.object_tree.itemExpanded.connect(self.fetch_children)
+        # the tooltips are only created when they are shown (see eventFilter)
+        self.object_tree.viewport().installEventFilter(self)
 
     # region Selection Methods
 
-    select_object = pyqtSignal(object)
-    deselect_object = pyqtSignal(object)
-    send_selection_set = pyqtSignal(object)
+    select_object = pyqtSignal(str)
+    deselect_object = pyqtSignal(str)
+    send_selection_set = pyqtSignal(list)
+    send_update_object = pyqtSignal(object)
 
 
     def send_selection(self, selected_items, deselected_items):
-        items = self.object_tree.selectedItems()
-        self.send_selection_set.emit(items)
-        for item in items:
-            entity = item.data(0, Qt.UserRole)
-            if hasattr(entity, "GlobalId"):
-                GlobalId = entity.GlobalId
-                if GlobalId != '':
-                    self.select_object.emit(GlobalId)
-                    print("IFCTreeWidget.send_selection.select_object ", GlobalId)
-
-        # send the deselected items as well
+        """
+        Collect the changes of the selection, which are sent to the
+        other views at once when the selection stops changing (see flush_selection)
+        """
+        # only the newly selected items, the others were sent before
+        for index in selected_items.indexes():
+            if index.column() == 0:  # only for first column, to avoid repeats
+                item = self.object_tree.itemFromIndex(index)
+                GlobalId = item.data(0, Qt.UserRole + 2)
+                if GlobalId:
+                    self.pending_deselected.pop(GlobalId, None)
+                    self.pending_selected[GlobalId] = None
+
+        # the deselected items as well
         for index in deselected_items.indexes():
             if index.column() == 0:  # only for first column, to avoid repeats
                 item = self.object_tree.itemFromIndex(index)
-                entity = item.data(0, Qt.UserRole)
-                if hasattr(entity, "GlobalId"):
-                    GlobalId = entity.GlobalId
-                    if GlobalId != '':
-                        self.deselect_object.emit(GlobalId)
-                        print("IFCTreeWidget.send_selection.deselect_object ", GlobalId)
+                GlobalId = item.data(0, Qt.UserRole + 2)
+                if GlobalId:
+                    self.pending_selected.pop(GlobalId, None)
+                    self.pending_deselected[GlobalId] = None
+        self.selection_timer.start()
+
+    def flush_selection(self):
+        """
+        Send the collected selection changes to the other views
+        """
+        self.selection_timer.stop()
+        self.send_selection_set.emit(self.object_tree.selectedItems())
+        for GlobalId in self.pending_selected:
+            self.select_object.emit(GlobalId)
+            logger.debug("IFCTreeWidget.send_selection.select_object %s", GlobalId)
+        for GlobalId in self.pending_deselected:
+            self.deselect_object.emit(GlobalId)
+            logger.debug("IFCTreeWidget.send_selection.deselect_object %s", GlobalId)
+        self.pending_selected.clear()
+        self.pending_deselected.clear()
 
     def receive_selection(self, ids):
-        print("IFCTreeWidget.receive_selection ", ids)
-        self.object_tree.clearSelection()
-        if not len(ids):
-            return
-        # TODO: this may take a while in large trees - should we have a cache?
-        iterator = QTreeWidgetItemIterator(self.object_tree)
-        while iterator.value():
-            item = iterator.value()
-            entity = item.data(0, Qt.UserRole)
-            if entity is not None and hasattr(entity, "GlobalId"):
-                if entity.GlobalId == ids:
+        """
+        Select the tree items of the objects with the given GlobalId(s)
+
+        :param ids: a single GlobalId or a list of them
+        """
+        logger.debug("IFCTreeWidget.receive_selection %s", ids)
+        if self.selection_timer.isActive():
+            self.flush_selection()  # send our own changes before they are replaced
+        if isinstance(ids, str):
+            ids = [ids] if ids else []
+        previous_ids = self.get_selected_ids()
+        # Change the selection without a selectionChanged per item,
+        # the other views are told about the whole change at once below
+        selection_model = self.object_tree.selectionModel()
+        selection_model.blockSignals(True)
+        last_item = None
+        try:
+            self.object_tree.clearSelection()
+            if self.pending_items and any(global_id not in self.object_items for global_id in ids):
+                self.fetch_all_children()  # the object may be in a branch which was not filled yet
+            for global_id in ids:
+                for item in self.object_items.get(global_id, []):
                     item.setSelected(not item.isSelected())
-                    index = self.object_tree.indexFromItem(item)
-                    self.object_tree.scrollTo(index)
-            iterator += 1
+                    last_item = item
+        finally:
+            selection_model.blockSignals(False)
+        self.object_tree.viewport().update()  # the view missed the signals as well
+        if last_item is not None:
+            self.object_tree.scrollToItem(last_item)
+
+        self.send_selection_set.emit(self.object_tree.selectedItems())
+        current_ids = self.get_selected_ids()
+        for global_id in previous_ids - current_ids:
+            self.deselect_object.emit(global_id)
+        for global_id in current_ids - previous_ids:
+            self.select_object.emit(global_id)
+
+    def get_selected_ids(self):
+        """
+        Return the GlobalIds of the objects of all selected items
+
+        :return: set of GlobalIds
+        """
+        ids = {item.data(0, Qt.UserRole + 2) for item in self.object_tree.selectedItems()}
+        ids.discard(None)
+        return ids
 
     def receive_object_update(self, ifc_object):
-        iterator = QTreeWidgetItemIterator(self.object_tree)
-        while iterator.value():
-            item = iterator.value()
-            entity = item.data(0, Qt.UserRole)
-            if entity == ifc_object:
+        # setText emits itemChanged, which would send the selection back
+        # and rebuild the property tree that sent this update, once per item
+        self.object_tree.blockSignals(True)
+        try:
+            global_id = get_global_id(ifc_object)
+            if global_id:
+                items = self.object_items.get(global_id, [])
+            else:
+                # the same STEP id can be used in other files, so check the entity as well
+                items = [item for item in self.step_items.get(ifc_object.id(), [])
+                         if item.data(0, Qt.UserRole) == ifc_object]
+            for item in items:
                 # refresh my name
                 item.setText(0, ifc_object.Name)
-            iterator += 1
+        finally:
+            self.object_tree.blockSignals(False)
 
     # endregion
 
@@ -140,27 +224,31 @@ class IFCTreeWidget(QWidget):
 
     def close_files(self):
         self.ifc_files.clear()
+        self.object_items.clear()
+        self.step_items.clear()
+        self.file_items.clear()
+        self.children_indices.clear()
+        self.pending_items.clear()
         self.object_tree.clear()
         self.prepare_chooser()
 
-    def load_file(self, filename):
+    def load_file(self, filename, ifc_file=None):
         """
         Load the file passed as filename and builds the whole object tree.
         If it already exists, that branch is removed and recreated.
 
         :param filename: Full path to the IFC file
+        :param ifc_file: the IFC model, when it was opened already (e.g., shared with other views)
         """
-        ifc_file = None
-        if filename in self.ifc_files:
-            ifc_file = self.ifc_files[filename]
-            for i in range(self.object_tree.topLevelItemCount()):
-                toplevel_item = self.object_tree.topLevelItem(i)
-                if toplevel_item is not None and filename == toplevel_item.text(0):
-                    root = self.object_tree.invisibleRootItem()
-                    root.removeChild(toplevel_item)
-        else:  # Load as new file
-            ifc_file = ifcopenshell.open(filename)
+        toplevel_item = self.file_items.pop(filename, None)
+        if toplevel_item is not None:
+            self.forget_object_items(toplevel_item)
+            root = self.object_tree.invisibleRootItem()
+            root.removeChild(toplevel_item)
+        if ifc_file is not None:
             self.ifc_files[filename] = ifc_file
+        elif filename not in self.ifc_files:  # Load as new file
+            self.ifc_files[filename] = ifcopenshell.open(filename)
 
         self.prepare_chooser()
         self.add_objects(filename)
@@ -178,9 +266,12 @@ class IFCTreeWidget(QWidget):
         ifc_file = self.ifc_files[filename]
         root_item = QTreeWidgetItem([filename, 'File'])
         root_item.setData(0, Qt.UserRole, ifc_file)
+        children_index = self.index_children(ifc_file)
+        self.children_indices[filename] = children_index
         try:
-            for item in ifc_file.by_type(self.root_class):
-                self.add_object_in_tree(item, root_item)
+            # the branch is built before it is added to the tree, so Qt is only notified once
+            root_item.addChildren([self.add_object_in_tree(item, children_index)
+                                   for item in ifc_file.by_type(self.root_class)])
         except:
             dlg = QMessageBox(self.parent())
             dlg.setWindowTitle("Invalid IFC Class!")
@@ -189,46 +280,215 @@ class IFCTreeWidget(QWidget):
             dlg.setText(str("{} is not a valid class name.\nSuggestions are IfcProject or IfcWall.").format(self.root_class))
             dlg.exec_()
         # Finish the GUI
-        self.object_tree.addTopLevelItem(root_item)
-        self.object_tree.expandToDepth(3)
+        self.object_tree.setUpdatesEnabled(False)
+        self.object_tree.blockSignals(True)
+        try:
+            self.object_tree.addTopLevelItem(root_item)
+            self.file_items[filename] = root_item
+            self.object_tree.expandToDepth(3)
+        finally:
+            self.object_tree.blockSignals(False)
+            self.object_tree.setUpdatesEnabled(True)
+
+    def add_object_in_tree(self, ifc_object, children_index, levels=3):
+        """
+        Create the tree item for an Object, filled with its children,
+        as defined by the relationships, up to the given number of levels
+        (the tree is expanded up to that level when a file is loaded).
+
+        :param ifc_object: an IFC entity instance
+        :type ifc_object: entity_instance
+        :param dict children_index: the children of the objects in the file (see index_children)
+        :param levels: number of levels of children to fill in, None = all
+        :return: the (detached) QTreeWidgetItem
+        """
+        tree_item = self.create_object_item(ifc_object)
+        if self.follow_decomposition:
+            self.fill_object_item(tree_item, children_index, levels)
+        return tree_item
+
+    def fill_object_item(self, tree_item, children_index, levels=1):
+        """
+        Add the children of an Object to its tree item. The hierarchy is collected
+        first (see collect_objects), then all items are created and the children
+        of each item are added at once.
+        Items at the last level only get an indicator if they have children,
+        which are added when the item is expanded (see fetch_children).
+
+        :param tree_item: the item of the Object
+        :type tree_item: QTreeWidgetItem
+        :param dict children_index: the children of the objects in the file (see index_children)
+        :param levels: number of levels of children to fill in, None = all
+        """
+        objects, parents, pending = self.collect_objects(tree_item.data(0, Qt.UserRole), children_index, levels)
+        items = [tree_item] + [self.create_object_item(ifc_object) for ifc_object in objects[1:]]
+        child_items = [[] for _ in items]
+        for index in range(1, len(items)):
+            child_items[parents[index]].append(items[index])
+        for item, children in zip(items, child_items):
+            if children:
+                item.addChildren(children)
+        for index in pending:
+            items[index].setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            items[index].setData(0, Qt.UserRole + 1, True)  # the children are still to be added
+            self.pending_items.append(items[index])
+
+    @staticmethod
+    def collect_objects(ifc_object, children_index, levels=1):
+        """
+        Collect an Object and its children up to the given number of levels,
+        without recursion and without creating any tree items.
 
-    def add_object_in_tree(self, ifc_object, parent_item):
+        :param ifc_object: an IFC entity instance
+        :type ifc_object: entity_instance
+        :param dict children_index: the children of the objects in the file (see index_children)
+        :param levels: number of levels of children to collect, None = all
+        :return: list of objects (starting with ifc_object), list with the index of the parent
+                 of each object (-1 for the first) and list of the indices of the objects
+                 at the last level which have children
+        """
+        objects = [ifc_object]
+        parents = [-1]
+        pending = []
+        stack = [(0, levels)]
+        while stack:
+            index, levels_left = stack.pop()
+            children = IFCTreeWidget.get_children(objects[index], children_index)
+            if not children:
+                continue
+            if levels_left == 0:
+                pending.append(index)
+                continue
+            first = len(objects)
+            objects.extend(children)
+            parents.extend([index] * len(children))
+            next_levels = None if levels_left is None else levels_left - 1
+            stack.extend((child_index, next_levels) for child_index in range(first, len(objects)))
+        return objects, parents, pending
+
+    def fetch_children(self, item, levels=1):
+        """
+        Add the children of an item which were not added yet
+
+        :param item: the expanded item
+        :type item: QTreeWidgetItem
+        :param levels: number of levels of children to fill in, None = all
+        """
+        if item.data(0, Qt.UserRole + 1) is not True:
+            return
+        self.object_tree.blockSignals(True)  # no itemChanged while filling in
+        try:
+            item.setData(0, Qt.UserRole + 1, None)
+            item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+            file_item = item
+            while file_item.parent() is not None:
+                file_item = file_item.parent()
+            self.fill_object_item(item, self.children_indices[file_item.text(0)], levels)
+        finally:
+            self.object_tree.blockSignals(False)
+
+    def fetch_all_children(self):
         """
-        Fill the Object Tree recursively with Objects and their
-        children, as defined by the relationships
+        Add all children which were not added yet, in the whole tree
+        """
+        # the list is kept, instead of searching the whole tree for the marked items
+        self.object_tree.setUpdatesEnabled(False)  # this can be most of the model
+        try:
+            while self.pending_items:
+                pending, self.pending_items = self.pending_items, []
+                for item in pending:
+                    self.fetch_children(item, None)  # skips the items which were expanded already
+        finally:
+            self.object_tree.setUpdatesEnabled(True)
+
+    def create_object_item(self, ifc_object):
+        """
+        Create the (detached) tree item for a single Object
 
         :param ifc_object: an IFC entity instance
         :type ifc_object: entity_instance
-        :param parent_item: the parent QTreeWidgetItem
-        :type parent_item: QTreeWidgetItem
+        :return: QTreeWidgetItem
         """
-        my_name = ifc_object.Name if hasattr(ifc_object, "Name") else ""
+        my_name = ifc_object.Name if has_attribute(ifc_object, "Name") else ""
         tree_item = QTreeWidgetItem([my_name, ifc_object.is_a()])
-        parent_item.addChild(tree_item)
         tree_item.setData(0, Qt.UserRole, ifc_object)
-        tree_item.setToolTip(0, entity_summary(ifc_object))
+        global_id = get_global_id(ifc_object)
+        if global_id:
+            tree_item.setData(0, Qt.UserRole + 2, global_id)  # read once, instead of on every selection
+            self.object_items.setdefault(global_id, []).append(tree_item)
+        else:
+            self.step_items.setdefault(ifc_object.id(), []).append(tree_item)
+        return tree_item
+
+    @staticmethod
+    def index_children(ifc_file):
+        """
+        Collect the children of all objects in a file, following containment,
+        decomposition and grouping, with one pass over each kind of relationship
+        instead of looking up the inverse attributes of every object.
 
-        if self.follow_decomposition:
-            if hasattr(ifc_object, 'ContainsElements'):
-                for rel in ifc_object.ContainsElements:
-                    for element in rel.RelatedElements:
-                        self.add_object_in_tree(element, tree_item)
-            if hasattr(ifc_object, 'IsDecomposedBy'):
-                for rel in ifc_object.IsDecomposedBy:
-                    for related_object in rel.RelatedObjects:
-                        self.add_object_in_tree(related_object, tree_item)
-            if hasattr(ifc_object, 'IsGroupedBy'):
-                for rel in ifc_object.IsGroupedBy:
-                    if hasattr(rel, 'RelatedObjects'):
-                        for related_object in rel.RelatedObjects:
-                            self.add_object_in_tree(related_object, tree_item)
-            if hasattr(ifc_object, 'AssignedItems'):  # objects on layers
-                for rep in ifc_object.AssignedItems:
-                    # self.add_object_in_tree(rep, tree_item)
-                    # From Shape Representation to Product Definition Shape to Product?
-                    for prod_def_shape in rep.OfProductRepresentation:
-                        for prod in prod_def_shape.ShapeOfProduct:
-                            self.add_object_in_tree(prod, tree_item)
+        :param ifc_file: the IFC model
+        :type ifc_file: ifcopenshell.file
+        :return: dictionary from the STEP id of an object to the list of its children
+        """
+        children_index = {}
+        for rel in ifc_file.by_type('IfcRelContainedInSpatialStructure'):  # ContainsElements
+            children_index.setdefault(rel.RelatingStructure.id(), []).extend(rel.RelatedElements)
+        # IsDecomposedBy also contains the nesting relationships in IFC2X3
+        decomposition = 'IfcRelDecomposes' if ifc_file.schema == 'IFC2X3' else 'IfcRelAggregates'
+        for rel in ifc_file.by_type(decomposition):  # IsDecomposedBy
+            children_index.setdefault(rel.RelatingObject.id(), []).extend(rel.RelatedObjects)
+        for rel in ifc_file.by_type('IfcRelAssignsToGroup'):  # IsGroupedBy
+            children_index.setdefault(rel.RelatingGroup.id(), []).extend(rel.RelatedObjects)
+        return children_index
+
+    @staticmethod
+    def get_children(ifc_object, children_index):
+        """
+        Return the Objects displayed below an Object in the tree,
+        following containment, decomposition, grouping and layer assignment
+
+        :param ifc_object: an IFC entity instance
+        :type ifc_object: entity_instance
+        :param dict children_index: the children of the objects in the file (see index_children)
+        :return: list of entity_instance
+        """
+        children = list(children_index.get(ifc_object.id(), ()))
+        if has_attribute(ifc_object, 'AssignedItems'):
+            for rep in ifc_object.AssignedItems:  # objects on layers
+                # From Shape Representation to Product Definition Shape to Product?
+                for prod_def_shape in rep.OfProductRepresentation:
+                    children.extend(prod_def_shape.ShapeOfProduct)
+        return children
+
+    def forget_object_items(self, branch_item):
+        """
+        Remove the items of a branch which is about to be removed
+        from the object_items and step_items dictionaries and the pending items
+
+        :param branch_item: the top item of the branch
+        :type branch_item: QTreeWidgetItem
+        """
+        removed = set()  # ids of the items, QTreeWidgetItem is not hashable
+        # only the branch itself: an iterator would continue with the next top-level items
+        stack = [branch_item]
+        while stack:
+            item = stack.pop()
+            stack.extend(item.child(i) for i in range(item.childCount()))
+            removed.add(id(item))
+            if item.text(1) == 'File':
+                continue
+            global_id = item.data(0, Qt.UserRole + 2)
+            if global_id is not None:
+                items_by_key, key = self.object_items, global_id
+            else:
+                items_by_key, key = self.step_items, item.data(0, Qt.UserRole).id()
+            items = [i for i in items_by_key.get(key, []) if i is not item]
+            if items:
+                items_by_key[key] = items
+            else:
+                items_by_key.pop(key, None)
+        self.pending_items = [item for item in self.pending_items if id(item) not in removed]
 
     def set_object_name_edit(self, item, column):
         """
@@ -242,11 +502,14 @@ class IFCTreeWidget(QWidget):
             return
         ifc_object = item.data(0, Qt.UserRole)
         if ifc_object is not None:
-            if hasattr(ifc_object, "Name"):
+            if has_attribute(ifc_object, "Name"):
                 ifc_object.Name = item.text(0)
-                # warn other views/widgets
-                items = self.object_tree.selectedItems()
-                self.send_selection_set.emit(items)
+                # warn other views/widgets, without the tree re-entering this method
+                self.object_tree.blockSignals(True)
+                try:
+                    self.send_update_object.emit(ifc_object)
+                finally:
+                    self.object_tree.blockSignals(False)
 
     def check_object_name_edit(self, item, column):
         """
@@ -269,6 +532,20 @@ class IFCTreeWidget(QWidget):
 
     # region UI Methods
 
+    def eventFilter(self, watched, event):
+        """
+        Show the summary of the object under the mouse as tooltip.
+        This is only prepared for the item which is hovered, instead of for all items.
+        """
+        if watched is self.object_tree.viewport() and event.type() == QEvent.ToolTip:
+            item = self.object_tree.itemAt(event.pos())
+            if item is not None and item.text(1) != 'File' and self.object_tree.columnAt(event.pos().x()) == 0:
+                QToolTip.showText(event.globalPos(), entity_summary(item.data(0, Qt.UserRole)), self.object_tree)
+            else:
+                QToolTip.hideText()
+            return True
+        return QWidget.eventFilter(self, watched, event)
+
     def toggle_decomposition(self):
         self.follow_decomposition = not self.follow_decomposition
         self.regenerate_tree()
@@ -281,19 +558,24 @@ class IFCTreeWidget(QWidget):
         buffer = self.root_class_chooser.currentText()
         if buffer == '':
             buffer = 'IfcProject'
-        self.root_class_chooser.clear()
+        # the classes used in any of the files, each only once
+        types = set()
         for _, file in self.ifc_files.items():
-            for t in file.wrapped_data.types():
-                if self.root_class_chooser.findText(t, Qt.MatchFixedString) == -1:  # require exact matching!
-                    self.root_class_chooser.addItem(t)
+            types.update(file.wrapped_data.types())
 
-        # Add all available classes in the Combobox
+        # Add all available classes in the Combobox, sorted and at once
+        self.root_class_chooser.clear()
+        self.root_class_chooser.addItems(sorted(types))
         self.root_class_chooser.setEditable(False)
-        self.root_class_chooser.model().sort(0, Qt.AscendingOrder)
         self.root_class_chooser.setCurrentText(buffer)
 
     def regenerate_tree(self):
         self.object_tree.clear()
+        self.object_items.clear()
+        self.step_items.clear()
+        self.file_items.clear()
+        self.children_indices.clear()
+        self.pending_items.clear()
         for filename, file in self.ifc_files.items():
             self.add_objects(filename)
 
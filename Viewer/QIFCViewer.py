@@ -1,12 +1,46 @@
-# import time
+import time
 import os.path
 from IFCCustomDelegate import *
-from IFCQt3DView import *
+# IFCQt3DView (Qt3D, numpy) is only imported when the 3D view is used, see QIFCViewer.__init__
 from IFCTreeWidget import *
 from IFCPropertyWidget import *
 from IFCListingWidget import *
 
 
+class IFCFileLoader(QThread):
+    """
+    Background thread which opens (parses) one IFC file, so the GUI stays
+    responsive while a large model is read. The views are filled in the
+    GUI thread, once the file is loaded.
+
+    ifcopenshell.open is a single blocking call, which reports no progress
+    and can not be interrupted, so the status bar only shows which file is
+    being loaded, and closing the application waits for it (see closeEvent).
+    """
+
+    # Carries the loader itself, so outdated loaders can be recognised, and the file (None on failure)
+    file_loaded = pyqtSignal(object, object)
+
+    def __init__(self, filename, parent=None):
+        """
+        :param filename: Full path to the IFC file
+        :param parent: the owner of the thread
+        """
+        QThread.__init__(self, parent)
+        self.filename = filename
+
+    def run(self):
+        start = time.time()
+        try:
+            ifc_file = ifcopenshell.open(self.filename)
+        except Exception as e:
+            print("Could not load ", self.filename, " - ", e)
+            ifc_file = None
+        else:
+            print("Loaded ", self.filename, " in ", time.time() - start, " seconds")
+        self.file_loaded.emit(self, ifc_file)
+
+
 class QIFCViewer(QMainWindow):
     """
     IFC Model Viewer
@@ -16,12 +50,14 @@ class QIFCViewer(QMainWindow):
     - V4 = Syncing updates & edits of values between Object and Property Tree
     - V5 = Supporting drag and drop of IFC files onto the app
     - V6 = Make the 3D view optional (switch)
+    - V7 = Opening files in a background thread, keeping the GUI responsive
     """
     def __init__(self):
         QMainWindow.__init__(self)
 
         # A dictionary referring to our files, based on name
         self.ifc_files = {}
+        self.file_loaders = {}  # from filename to the IFCFileLoader which is still running
         self.setAcceptDrops(True)
         self.settings = QSettings()
 
@@ -68,7 +104,7 @@ class QIFCViewer(QMainWindow):
         action_quit = QAction("Quit", self)
         action_quit.setShortcut("CTRL+Q")
         action_quit.setStatusTip("Quit the application")
-        action_quit.triggered.connect(qApp.quit)
+        action_quit.triggered.connect(self.close)  # see closeEvent
         file_menu.addAction(action_quit)
 
         # Option : USE 3D
@@ -82,6 +118,7 @@ class QIFCViewer(QMainWindow):
 
         # Main Widgets
         if self.USE_3D:
+            from IFCQt3DView import IFCQt3dView
             self.view_3d = IFCQt3dView()
         self.view_tree = IFCTreeWidget()
         self.view_properties = IFCPropertyWidget()
@@ -93,6 +130,7 @@ class QIFCViewer(QMainWindow):
             self.view_tree.deselect_object.connect(self.view_3d.deselect_object_by_id)
             self.view_3d.add_to_selected_entities.connect(self.view_tree.receive_selection)
             self.view_3d.add_to_selected_entities.connect(self.view_takeoff.receive_selection)
+            self.view_3d.geometry_loaded.connect(self.finish_loading_geometry)
             self.view_takeoff.select_object.connect(self.view_3d.select_object_by_id)
             # self.view_takeoff.deselect_object.connect(self.view_3d.deselect_object_by_id)
         # from tree to other views
@@ -104,6 +142,7 @@ class QIFCViewer(QMainWindow):
 
         # Update Syncing
         self.view_properties.send_update_object.connect(self.view_tree.receive_object_update)
+        self.view_tree.send_update_object.connect(self.view_properties.receive_object_update)
 
         # Docking Widgets
         if self.USE_3D is True:
@@ -134,9 +173,11 @@ class QIFCViewer(QMainWindow):
         """
         Load an IFC file from the given path. If the file was already loaded,
         the user is asked if the file should be replaced.
+        The file is opened in the background and added to the views
+        when it is ready (see add_loaded_file).
 
         :param filename: full path to the IFC file
-        :return: True if the file was loaded, False if cancelled.
+        :return: True if the file is being loaded, False if cancelled.
         """
         if filename in self.ifc_files:
             # Display warning that this model was already loaded. Replace or Cancel.
@@ -150,23 +191,61 @@ class QIFCViewer(QMainWindow):
             if button == QMessageBox.Cancel:
                 return False
 
-        start = time.time()
-        ifc_file = ifcopenshell.open(filename)
-        print("Loaded ", filename, " in ", time.time() - start, " seconds")
+        loader = IFCFileLoader(filename, self)
+        loader.file_loaded.connect(self.add_loaded_file)
+        self.file_loaders[filename] = loader  # the result of an older loader is ignored
+        self.statusBar().showMessage(str("Loading {} ...").format(filename))
+        loader.start()
+        return True
+
+    def add_loaded_file(self, loader, ifc_file):
+        """
+        Add a file opened by an IFCFileLoader to all views.
+
+        :param loader: the IFCFileLoader which has finished
+        :param ifc_file: the opened IFC model, or None if it could not be loaded
+        """
+        loader.wait()  # run() returns right after sending its signal
+        loader.deleteLater()
+        filename = loader.filename
+        if self.file_loaders.get(filename) is not loader:
+            return  # outdated, or the files were closed in the meantime
+        del self.file_loaders[filename]
+        if ifc_file is None:
+            self.statusBar().showMessage(str("Could not load {}").format(filename))
+            return
         self.ifc_files[filename] = ifc_file
 
         # print("Loading Views ...")
         start = time.time()
-        self.view_tree.ifc_files[filename] = ifc_file
-        self.view_tree.load_file(filename)
+        # all views share the same model, none of them opens the file again
+        self.view_tree.load_file(filename, ifc_file)
+
+        self.view_takeoff.load_file(filename, ifc_file)
+        print("Loaded all views in ", time.time() - start)
+        self.statusBar().clearMessage()
+        self.update_title()
 
         if self.USE_3D:
-            self.view_3d.ifc_files[filename] = ifc_file
-            self.view_3d.load_file(filename)
+            # the geometry is started after the tree has been shown
+            self.statusBar().showMessage(str("Loading geometry of {} ...").format(filename))
+            QTimer.singleShot(0, lambda: self.load_geometry(filename, ifc_file))
 
-        self.view_takeoff.ifc_files[filename] = ifc_file
-        print("Loaded all views in ", time.time() - start)
-        return True
+    def load_geometry(self, filename, ifc_file):
+        """
+        Start loading the geometry of a file in the 3D view,
+        unless the file was closed or replaced in the meantime.
+
+        :param filename: full path to the IFC file
+        :param ifc_file: the IFC model which was loaded
+        """
+        if self.ifc_files.get(filename) is ifc_file:
+            self.view_3d.load_file(filename, ifc_file)
+
+    def finish_loading_geometry(self, filename):
+        # keep the message while other files are still loading
+        if not self.file_loaders and not self.view_3d.loaders:
+            self.statusBar().clearMessage()
 
     def dragEnterEvent(self, event):
         data = event.mimeData()
@@ -233,27 +312,46 @@ class QIFCViewer(QMainWindow):
         # self.setWindowTitle("IFC Viewer")
         for file in filenames:
             if os.path.isfile(file):
-                if self.load_file(file):
-                    # Concatenate all file names
-                    title = "IFC Viewer"
-                    for filename, file in self.ifc_files.items():
-                        title += " - " + os.path.basename(filename)
-                    if len(title) > 64:
-                        title = title[:64] + "..."
-                    self.setWindowTitle(title)
+                self.load_file(file)
+
+    def update_title(self):
+        """
+        Show the names of all loaded files in the window title
+        """
+        # Concatenate all file names
+        title = "IFC Viewer"
+        for filename, file in self.ifc_files.items():
+            title += " - " + os.path.basename(filename)
+        if len(title) > 64:
+            title = title[:64] + "..."
+        self.setWindowTitle(title)
 
     def close_files(self):
         """
         Close all loaded files (and clear the different views)
         """
         self.ifc_files = {}
+        self.file_loaders.clear()  # files which are still loading are not added anymore
+        self.statusBar().clearMessage()
         self.view_tree.close_files()
-        self.view_properties.reset()
+        self.view_properties.close_files()
         if self.USE_3D:
             self.view_3d.close_files()
         self.view_takeoff.close_files()
         self.setWindowTitle("IFC Viewer")
 
+    def closeEvent(self, event):
+        """
+        Stop the background threads before the window (their parent) is destroyed,
+        as Qt aborts when a thread is destroyed while it is still running.
+        """
+        if self.USE_3D:
+            self.view_3d.close()  # stops its geometry loaders, see IFCQt3dView.closeEvent
+        self.file_loaders.clear()  # their files are not added anymore
+        for loader in self.findChildren(IFCFileLoader):
+            loader.wait()  # ifcopenshell.open can not be interrupted
+        event.accept()
+
     def toggle_use_3d(self):
         self.USE_3D = not self.USE_3D
         self.settings.setValue("USE_3D", self.USE_3D)
@@ -275,11 +373,10 @@ def main():
     w = QIFCViewer()
     w.setWindowTitle("IFC Viewer")
     w.resize(1280, 800)
+    w.show()  # first show the (empty) window, the file is loaded in the background
     filename = sys.argv[1] if len(sys.argv) >= 2 else ''
     if os.path.isfile(filename):
-        w.load_file(filename)
-        w.setWindowTitle(w.windowTitle() + " - " + os.path.basename(filename))
-    w.show()
+        w.load_file(filename)  # the title is updated once the file is loaded
     sys.exit(app.exec_())
 
 